@@ -0,0 +1,22 @@
+# 只需在升级到预渲染正文、搜索索引、关注时间线和头像变体的版本后运行一次；
+# 新写入的数据由保存时的逻辑和后台任务维护，日常部署只需运行 init_server.sh
+echo "Backfilling data for existing posts, attachments and users..."
+
+echo "Optimizing existing image attachments..."
+python manage.py optimize_attachments
+
+echo "Rendering post bodies and excerpts..."
+python manage.py rerender_posts
+
+echo "Rebuilding the search index..."
+python manage.py rebuild_search_index
+
+echo "Rebuilding follower timelines..."
+python manage.py rebuild_timelines
+
+echo "Generating avatar variants..."
+python manage.py process_avatars
+
+echo "------------------------------------------------"
+echo "✅ Backfill complete!"
+echo "------------------------------------------------"
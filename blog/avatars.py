@@ -0,0 +1,94 @@
+import hashlib
+from io import BytesIO
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+AVATAR_SIZES = (32, 64, 200)
+AVATAR_FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+AVATAR_QUALITY = 85
+DEFAULT_AVATAR_URL = '/static/images/default.png'
+VARIANT_PREFIX = 'avatars/variants'
+
+
+def file_hash(field):
+    digest = hashlib.sha256()
+    field.open('rb')
+    try:
+        for chunk in field.chunks():
+            digest.update(chunk)
+    finally:
+        field.close()
+    return digest.hexdigest()
+
+
+def variant_name(digest, size, ext='webp'):
+    # 文件名由源图哈希决定，同一张图永远对应同一组变体
+    return f'{VARIANT_PREFIX}/{digest[:2]}/{digest}/{size}.{ext}'
+
+
+def variant_url(digest, size, ext='webp'):
+    return default_storage.url(variant_name(digest, size, ext))
+
+
+def square(img):
+    width, height = img.size
+    side = min(width, height)
+    left = (width - side) // 2
+    top = (height - side) // 2
+    return img.crop((left, top, left + side, top + side))
+
+
+def build_variants(field, digest):
+    field.open('rb')
+    try:
+        img = ImageOps.exif_transpose(Image.open(field))
+        img = square(img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB'))
+    finally:
+        field.close()
+    names = []
+    for size in AVATAR_SIZES:
+        resized = img.resize((size, size), Image.LANCZOS) if img.width > size else img
+        for ext, fmt in AVATAR_FORMATS.items():
+            frame = resized.convert('RGB') if fmt == 'JPEG' else resized
+            buffer = BytesIO()
+            frame.save(buffer, fmt, quality=AVATAR_QUALITY)
+            name = variant_name(digest, size, ext)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            names.append(default_storage.save(name, ContentFile(buffer.getvalue())))
+    return names
+
+
+def release_variants(digest):
+    """头像换掉后删除旧图的变体；同一张图还被别的资料使用时保留。"""
+    Profile = apps.get_model('blog', 'Profile')
+    if not digest or Profile.objects.filter(avatar_hash=digest).exists():
+        return
+    for size in AVATAR_SIZES:
+        for ext in AVATAR_FORMATS:
+            default_storage.delete(variant_name(digest, size, ext))
+
+
+def variants_exist(digest):
+    return all(default_storage.exists(variant_name(digest, size, ext))
+               for size in AVATAR_SIZES for ext in AVATAR_FORMATS)
+
+
+def refresh_variants(profile):
+    """生成头像的各尺寸变体，源图未变化时直接返回 False。"""
+    if not profile.avatar:
+        return False
+    digest = file_hash(profile.avatar)
+    if digest == profile.avatar_hash and variants_exist(digest):
+        return False
+    build_variants(profile.avatar, digest)
+    replaced = profile.avatar_hash
+    profile.avatar_hash = digest
+    # 经过 save() 写入，post_save 会让作者的页面和条件请求的校验值跟着变
+    profile.save(update_fields=['avatar_hash'])
+    if replaced != digest:
+        release_variants(replaced)
+    return True
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import Attachment, UploadSession, touch_post
+from .pagecache import invalidate_pages
+from .uploads import check_upload_name
+
+CHUNK_SIZE = 2 * 1024 * 1024
+MAX_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024
+UPLOAD_EXPIRY = timedelta(days=1)
+READ_BLOCK_SIZE = 64 * 1024
+# 每个用户同时未完成（或完成了还没发到文章里）的上传数量和总字节数
+MAX_OPEN_UPLOADS = 5
+MAX_OPEN_UPLOAD_BYTES = 2 * MAX_UPLOAD_SIZE
+# 写分片的请求中途挂掉时，过了这么久别的请求才能接手
+CHUNK_LOCK_TIMEOUT = timedelta(minutes=5)
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def part_path(session):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{session.pk}.part')
+
+
+def open_uploads(user):
+    return UploadSession.objects.filter(Q(attachment__isnull=True) | Q(attachment__post__isnull=True), user=user)
+
+
+def start_upload(user, filename, size, sha256=''):
+    if size <= 0 or size > MAX_UPLOAD_SIZE:
+        raise UploadError('文件大小不合法')
+    try:
+        check_upload_name(filename)
+    except ValidationError as e:
+        raise UploadError(e.messages[0])
+    # 过期的上传不占配额
+    purge_stale_uploads(user=user)
+    with transaction.atomic():
+        # 锁住用户行，同一用户并发开始的上传依次检查配额
+        User.objects.select_for_update().only('pk').get(pk=user.pk)
+        usage = open_uploads(user).aggregate(count=Count('pk'), size=Sum('size'))
+        if usage['count'] >= MAX_OPEN_UPLOADS:
+            raise UploadError('未完成的上传太多，请先完成或等待过期', status=429)
+        if (usage['size'] or 0) + size > MAX_OPEN_UPLOAD_BYTES:
+            raise UploadError('未完成的上传总大小超出限制', status=429)
+        session = UploadSession.objects.create(
+            user=user, filename=os.path.basename(filename)[:255] or 'upload', size=size, sha256=sha256.lower(),
+        )
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    open(part_path(session), 'wb').close()
+    return session
+
+
+def claim_chunk(session, offset):
+    """以条件 UPDATE 抢占从 offset 开始的写入，返回抢占时间；已被别的请求抢占或偏移量已变时返回 None。"""
+    now = timezone.now()
+    claimed = UploadSession.objects.filter(
+        Q(locked_at__isnull=True) | Q(locked_at__lt=now - CHUNK_LOCK_TIMEOUT),
+        pk=session.pk, received=offset, attachment__isnull=True,
+    ).update(locked_at=now, updated_at=now)
+    return now if claimed else None
+
+
+def write_chunk(session, offset, stream, checksum):
+    """把一个分片追加到磁盘上的临时文件，校验失败时回滚到分片开始的位置。"""
+    if session.attachment_id:
+        raise UploadError('上传已完成', status=409)
+    if session.updated_at < timezone.now() - UPLOAD_EXPIRY:
+        purge_upload(session)
+        raise UploadError('上传已过期，请重新上传', status=410)
+    # 最后一个分片写完后合并失败过时，直接重试合并
+    retry_finish = session.received == session.size
+    if not retry_finish and offset != session.received:
+        # 断线重连后客户端从服务器记录的偏移量继续
+        raise UploadError('分片偏移量不匹配', status=409)
+
+    # 先抢占再动临时文件，同一偏移量的并发请求只有一个能写
+    claimed_at = claim_chunk(session, session.received)
+    if claimed_at is None:
+        raise UploadError('分片正在被其他请求写入', status=409)
+    try:
+        if retry_finish:
+            finish_upload(session)
+        else:
+            receive_chunk(session, offset, stream, checksum)
+    finally:
+        UploadSession.objects.filter(pk=session.pk, locked_at=claimed_at).update(locked_at=None)
+    return session
+
+
+def receive_chunk(session, offset, stream, checksum):
+    digest = hashlib.sha256()
+    written = 0
+    limit = min(CHUNK_SIZE, session.size - offset)
+    with open(part_path(session), 'r+b') as part:
+        # 上次连接中断时可能留下了半个分片
+        part.truncate(offset)
+        part.seek(offset)
+        while True:
+            block = stream.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            written += len(block)
+            if written > limit:
+                part.truncate(offset)
+                raise UploadError('分片超出大小限制')
+            digest.update(block)
+            part.write(block)
+        if not written or digest.hexdigest() != (checksum or '').lower():
+            part.truncate(offset)
+            raise UploadError('分片校验失败')
+
+    UploadSession.objects.filter(pk=session.pk).update(received=offset + written, updated_at=timezone.now())
+    session.received = offset + written
+    if session.received == session.size:
+        finish_upload(session)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as part:
+        for block in iter(lambda: part.read(READ_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finish_upload(session):
+    path = part_path(session)
+    digest = file_digest(path)
+    if session.sha256 and digest != session.sha256:
+        session.received = 0
+        session.save(update_fields=['received', 'updated_at'])
+        open(path, 'wb').close()
+        raise UploadError('文件校验失败，请重新上传')
+
+    with open(path, 'rb') as part:
+        upload = File(part, name=session.filename)
+        upload.sha256 = digest
+        with transaction.atomic():
+            session.attachment = Attachment.from_upload(upload)
+            session.save(update_fields=['attachment', 'updated_at'])
+    os.remove(path)
+    return session.attachment
+
+
+def attach_uploads(post, user, upload_ids):
+    valid_ids = []
+    for upload_id in upload_ids:
+        try:
+            valid_ids.append(uuid.UUID(upload_id))
+        except ValueError:
+            continue
+    if not valid_ids:
+        return 0
+    attached = Attachment.objects.filter(
+        upload_session__user=user, upload_session__pk__in=valid_ids, post__isnull=True,
+    ).update(post=post)
+    if attached:
+        touch_post(post.pk)
+        invalidate_pages(f'post:{post.pk}')
+    return attached
+
+
+def purge_upload(session):
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+    if session.attachment_id:
+        # 传完了却一直没发到文章里的附件一起删掉
+        Attachment.objects.filter(pk=session.attachment_id, post__isnull=True).delete()
+    session.delete()
+
+
+def purge_stale_uploads(now=None, user=None):
+    """删除过期未完成的上传，以及完成后一直没有关联到文章的上传。"""
+    cutoff = (now or timezone.now()) - UPLOAD_EXPIRY
+    stale = UploadSession.objects.filter(
+        Q(attachment__isnull=True) | Q(attachment__post__isnull=True), updated_at__lt=cutoff,
+    )
+    if user is not None:
+        stale = stale.filter(user=user)
+    count = 0
+    for session in stale.iterator():
+        purge_upload(session)
+        count += 1
+    return count
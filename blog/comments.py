@@ -0,0 +1,59 @@
+from django.db.models import Count
+from django.template.loader import render_to_string
+from .models import Comment
+from .pagination import keyset_page
+
+COMMENT_PAGE_SIZE = 20
+
+def build_comment_tree(comments):
+    by_id = {comment.id: comment for comment in comments}
+    roots = []
+    for comment in comments:
+        comment.children = []
+    for comment in comments:
+        parent = by_id.get(comment.parent_id)
+        if parent is None:
+            roots.append(comment)
+            continue
+        comment.parent = parent
+        parent.children.append(comment)
+    return roots
+
+def walk_comment_tree(nodes):
+    for node in nodes:
+        yield node
+        yield from walk_comment_tree(node.children)
+
+def comment_queryset():
+    return Comment.objects.select_related('author__profile')
+
+def load_comment_page(post, cursor=None, limit=COMMENT_PAGE_SIZE):
+    roots = comment_queryset().filter(post=post, parent__isnull=True) \
+        .annotate(reply_count=Count('thread_replies'))
+    roots, next_cursor = keyset_page(roots, 'created_date', 'id', cursor, limit, descending=False)
+    for root in roots:
+        root.children = []
+    return roots, next_cursor
+
+def load_replies(root):
+    replies = list(comment_queryset().filter(root=root).order_by('created_date', 'id'))
+    root.children = []
+    build_comment_tree([root] + replies)
+    return list(walk_comment_tree(root.children))
+
+def comment_payload(comment, request=None, html=True):
+    profile = comment.author.profile
+    payload = {
+        'status': 'success',
+        'comment_id': comment.id,
+        'author_nickname': profile.nickname or comment.author.username,
+        'author_username': comment.author.username,
+        'text': comment.text,
+        'created_date': comment.created_date.strftime('%Y-%m-%d %H:%M'),
+        'avatar_url': profile.avatar_url(64),
+        'parent_id': comment.parent_id,
+    }
+    if html:
+        comment.children = []
+        payload['html'] = render_to_string('blog/comment_thread.html', {'node': comment}, request=request)
+    return payload
\ No newline at end of file
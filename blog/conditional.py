@@ -0,0 +1,91 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from .models import Post
+from .pagecache import ALL_PAGES, tag_versions
+
+
+def make_etag(request, values):
+    # 页面里嵌着 CSRF token，令牌轮换后旧页面不能再当作未修改
+    values = [values, request.COOKIES.get(settings.CSRF_COOKIE_NAME)]
+    # 登录用户的页面带有个人的导航栏和按钮，校验值要区分用户；未读数由页面自己轮询，不在其中
+    if request.user.is_authenticated:
+        values.append(request.user.pk)
+    raw = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def cached_validators(request, compute):
+    # etag 和 last_modified 两个回调共用同一次查询
+    if not hasattr(request, '_page_validators'):
+        request._page_validators = compute()
+    return request._page_validators
+
+
+def skip_validation(request):
+    # 还没显示的提示消息不能被 304 吞掉
+    return request.method not in ('GET', 'HEAD') or 'messages' in request.COOKIES
+
+
+def post_detail_validators(request, pk):
+    def compute():
+        if skip_validation(request):
+            return None
+        row = Post.objects.filter(pk=pk).values(
+            'updated_at', 'like_count', 'author__profile__nickname', 'author__profile__avatar_hash',
+        ).annotate(
+            comment_count=Count('comments'),
+            last_comment=Max('comments__updated_at'),
+            comment_likes=Sum('comments__like_count'),
+        ).order_by('pk').first()
+        if row is None:
+            return None
+        last_modified = max(filter(None, (row['updated_at'], row['last_comment'])))
+        return make_etag(request, row), last_modified, row['comment_count']
+    return cached_validators(request, compute)
+
+
+def validated_comment_count(request):
+    """条件请求校验时已经数过这篇文章的评论，渲染页面时直接复用；没有校验过时返回 None。"""
+    result = getattr(request, '_page_validators', None)
+    return result[2] if result else None
+
+
+def post_list_validators(request, tag_name=None):
+    def compute():
+        if skip_validation(request):
+            return None
+        posts = Post.objects.filter(published_date__lte=timezone.now())
+        if tag_name:
+            posts = posts.filter(tags__name=tag_name)
+        # 两次都是按索引取一行：最新发布的文章和最近修改的文章（点赞、作者改昵称换头像都会推进 updated_at）
+        newest = posts.order_by('-published_date').values_list('published_date', flat=True).first()
+        if newest is None:
+            return None
+        updated = posts.order_by('-updated_at').values_list('updated_at', flat=True).first()
+        # 删除文章不会推进上面任何一个时间，由清除页面缓存时递增的标签版本体现
+        versions = tag_versions(['posts', ALL_PAGES])
+        return make_etag(request, [newest, updated, versions]), max(newest, updated)
+    return cached_validators(request, compute)
+
+
+def conditional_page(validators):
+    """在渲染之前用校验值回答 If-None-Match / If-Modified-Since，命中时直接返回 304。"""
+
+    def etag(request, *args, **kwargs):
+        result = validators(request, *args, **kwargs)
+        return result and result[0]
+
+    def last_modified(request, *args, **kwargs):
+        if request.user.is_authenticated:
+            # 同一浏览器换了账号时，只凭时间判断会把别人的页面当成未修改
+            return None
+        result = validators(request, *args, **kwargs)
+        return result and result[1]
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
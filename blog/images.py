@@ -0,0 +1,64 @@
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+IMAGE_MAX_WIDTH = 1600
+IMAGE_SRCSET_WIDTHS = (480, 960)
+IMAGE_QUALITY = 80
+IMAGE_EXT = 'webp'
+IMAGE_FORMAT = 'WEBP'
+IMAGE_SIZES = '(max-width: 900px) 100vw, 900px'
+# 解码前先按文件头里的宽高拦下超大图片，几十 KB 的文件也可能解压出几个 GB 的位图
+IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+
+
+class OptimizedImage:
+    def __init__(self, content, width, height, variants, source_size):
+        self.content = content
+        self.width = width
+        self.height = height
+        self.variants = variants
+        self.source_size = source_size
+
+
+def _encode(img, name):
+    buffer = BytesIO()
+    # 重新编码时不带 exif，相机信息和 GPS 坐标一并去掉
+    img.save(buffer, IMAGE_FORMAT, quality=IMAGE_QUALITY, method=4)
+    return ContentFile(buffer.getvalue(), name=name)
+
+
+def _resize(img, width):
+    if img.width <= width:
+        return img
+    return img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+
+
+def optimize_image(upload):
+    """把上传的图片转成限宽的 WebP 并生成 srcset 变体；不是可处理的位图时返回 None。"""
+    try:
+        upload.seek(0)
+        img = Image.open(upload)
+        if img.width * img.height > IMAGE_MAX_PIXELS:
+            return None
+        img.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        return None
+    finally:
+        upload.seek(0)
+    if getattr(img, 'is_animated', False):
+        return None
+
+    img = ImageOps.exif_transpose(img)
+    img = img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    source_size = img.size
+    img = _resize(img, IMAGE_MAX_WIDTH)
+    stem = os.path.splitext(os.path.basename(upload.name))[0]
+    variants = [
+        (width, _encode(_resize(img, width), f'{stem}-{width}w.{IMAGE_EXT}'))
+        for width in IMAGE_SRCSET_WIDTHS if width < img.width
+    ]
+    return OptimizedImage(_encode(img, f'{stem}.{IMAGE_EXT}'), img.width, img.height, variants, source_size)
+
@@ -0,0 +1,61 @@
+import time
+
+from django.contrib.auth.models import User, update_last_login
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+
+def legacy_save_user_profile(sender, instance, **kwargs):
+    # 旧实现：每次 User 保存都整行保存 Profile，并重新打开头像文件
+    profile = instance.profile
+    super(type(profile), profile).save()
+    if profile.avatar and profile.avatar.storage.exists(profile.avatar.name):
+        Image.open(profile.avatar.path).close()
+
+
+class Command(BaseCommand):
+    help = 'Measure the database queries and time a login spends on User/Profile saves, before and after change tracking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='User to log in as (defaults to the first user)')
+        parser.add_argument('--rounds', type=int, default=200)
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['username']:
+            users = users.filter(username=options['username'])
+        user = users.first()
+        if user is None:
+            raise CommandError('No user to log in as.')
+
+        results = {}
+        for label, legacy in (('before', True), ('after', False)):
+            if legacy:
+                post_save.connect(legacy_save_user_profile, sender=User, dispatch_uid='benchmark_login_legacy')
+            try:
+                results[label] = self.measure(user.pk, options['rounds'])
+            finally:
+                post_save.disconnect(sender=User, dispatch_uid='benchmark_login_legacy')
+
+        for label, (queries, elapsed) in results.items():
+            self.stdout.write(f'{label:>6}: {queries:.1f} queries, {elapsed * 1000:.2f} ms per login')
+        before, after = results['before'], results['after']
+        self.stdout.write(self.style.SUCCESS(
+            f'Saved {before[0] - after[0]:.1f} queries and {(before[1] - after[1]) * 1000:.2f} ms per login.'
+        ))
+
+    def measure(self, user_id, rounds):
+        queries = elapsed = 0
+        with transaction.atomic():
+            for _ in range(rounds):
+                # 与 ModelBackend + login() 一样：取出用户后只更新 last_login
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    update_last_login(None, User.objects.get(pk=user_id))
+                    elapsed += time.perf_counter() - started
+                queries += len(captured)
+            transaction.set_rollback(True)
+        return queries / rounds, elapsed / rounds
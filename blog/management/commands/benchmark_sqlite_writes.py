@@ -0,0 +1,85 @@
+import multiprocessing
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+
+BENCH_ALIAS = 'sqlite_bench'
+# 旧配置：回滚日志、每次提交都 fsync、读锁到写的时候才升级
+LEGACY_PRAGMAS = 'PRAGMA journal_mode=DELETE;PRAGMA synchronous=FULL'
+
+
+def use_profile(path, options):
+    settings_dict = dict(connections['default'].settings_dict, NAME=path, OPTIONS=options, CONN_MAX_AGE=0)
+    if BENCH_ALIAS in connections.settings:
+        # 上一轮的连接对象还指向旧文件
+        connections[BENCH_ALIAS].close()
+        del connections[BENCH_ALIAS]
+    connections.settings[BENCH_ALIAS] = settings_dict
+    return connections[BENCH_ALIAS]
+
+
+def write_worker(path, options, worker, transactions, results):
+    # fork 出来的进程不能沿用父进程的连接
+    connections.close_all()
+    connection = use_profile(path, options)
+    done = locked = 0
+    for n in range(transactions):
+        try:
+            # 和点赞一样：先读后写，在同一个事务里
+            with transaction.atomic(using=BENCH_ALIAS), connection.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM bench_event WHERE worker = %s', [worker])
+                cursor.execute('INSERT INTO bench_event (worker, n, payload) VALUES (%s, %s, %s)', [worker, n, 'x' * 200])
+            done += 1
+        except OperationalError:
+            locked += 1
+    connection.close()
+    results.put((done, locked))
+
+
+class Command(BaseCommand):
+    help = 'Compare SQLite write throughput of the legacy and production connection profiles with several processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--transactions', type=int, default=300, help='Write transactions per worker')
+
+    def run_profile(self, label, options, workers, transactions):
+        context = multiprocessing.get_context('fork')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.sqlite3')
+            with use_profile(path, options).cursor() as cursor:
+                cursor.execute('CREATE TABLE bench_event (id INTEGER PRIMARY KEY, worker INTEGER, n INTEGER, payload TEXT)')
+                cursor.execute('CREATE INDEX bench_event_worker ON bench_event (worker)')
+            connections.close_all()
+
+            results = context.Queue()
+            processes = [
+                context.Process(target=write_worker, args=(path, options, worker, transactions, results))
+                for worker in range(workers)
+            ]
+            start = time.perf_counter()
+            for process in processes:
+                process.start()
+            outcomes = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+            elapsed = time.perf_counter() - start
+
+        done = sum(outcome[0] for outcome in outcomes)
+        locked = sum(outcome[1] for outcome in outcomes)
+        self.stdout.write(
+            f'{label}: {done} commits in {elapsed:.2f}s = {done / elapsed:.0f} tx/s, {locked} "database is locked" errors'
+        )
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('This benchmark only applies to the SQLite backend.')
+        workers, transactions = options['workers'], options['transactions']
+        self.stdout.write(f'{workers} processes x {transactions} read-then-write transactions')
+        self.run_profile('legacy', {'init_command': LEGACY_PRAGMAS}, workers, transactions)
+        self.run_profile('production', settings.SQLITE_OPTIONS, workers, transactions)
+        self.stdout.write(self.style.SUCCESS('Done.'))
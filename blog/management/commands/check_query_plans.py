@@ -0,0 +1,78 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from blog.models import Post, Comment, Message, Attachment, AttachmentVariant
+from blog.timeline import recent_posts
+
+# 全表扫描在各数据库执行计划里的写法；SQLite 的 "SCAN t USING INDEX" 是按索引顺序扫描，不算
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (\w+)\s*$', re.M),
+    'postgresql': re.compile(r'\bSeq Scan on (\w+)'),
+}
+
+
+def hot_queries(user_id, post_id):
+    now = timezone.now()
+    return {
+        'post_list': Post.objects.filter(published_date__lte=now).order_by('-published_date', '-id')[:6],
+        # 列表页条件请求的校验值
+        'post_list_newest': Post.objects.filter(published_date__lte=now).order_by('-published_date')[:1],
+        'post_list_updated': Post.objects.filter(published_date__lte=now).order_by('-updated_at')[:1],
+        'profile_posts': Post.objects.filter(author_id=user_id).order_by('-published_date'),
+        'profile_activity': Post.objects.filter(author_id=user_id, created_date__gte=now - timedelta(days=365)),
+        'timeline_backfill': recent_posts([user_id]),
+        'comment_page': Comment.objects.filter(post_id=post_id, parent__isnull=True)
+            .annotate(reply_count=Count('thread_replies')).order_by('created_date', 'id')[:21],
+        'recent_comments': Comment.objects.filter(author_id=user_id).order_by('-created_date')[:10],
+        'unread_replies': Comment.objects.filter(parent__author_id=user_id, is_read=False),
+        'unread_comment_count': Comment.objects.filter(
+            Q(post__author_id=user_id) | Q(parent__author_id=user_id), is_read=False
+        ).exclude(author_id=user_id).distinct(),
+        'inbox': Message.objects.filter(recipient_id=user_id, deleted_by_recipient=False),
+        'outbox': Message.objects.filter(sender_id=user_id, deleted_by_sender=False),
+        'unread_message_count': Message.objects.filter(recipient_id=user_id, is_read=False, deleted_by_recipient=False),
+        # 删除 blob 前检查是否还有引用
+        'blob_references': Attachment.objects.filter(file='attachments/blobs/00/00/0.webp'),
+        'blob_variant_references': AttachmentVariant.objects.filter(file='attachments/blobs/00/00/0.webp'),
+    }
+
+
+def query_plans(user_id=1, post_id=1):
+    """逐条给出热点查询的 (名称, 执行计划, 被全表扫描的表)。"""
+    pattern = FULL_SCAN_PATTERNS.get(connection.vendor)
+    if pattern is None:
+        raise CommandError(f'Query plan checks are not supported on {connection.vendor}.')
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # 测试库数据很少，规划器本来就会选顺序扫描；关掉它再看索引能不能用上
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        for label, queryset in hot_queries(user_id, post_id).items():
+            plan = queryset.explain()
+            yield label, plan, sorted(set(pattern.findall(plan)))
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN on the hot view queries and fail if any of them falls back to a full table scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every query plan')
+
+    def handle(self, *args, **options):
+        scans = []
+        for label, plan, tables in query_plans():
+            if options['verbose_plans']:
+                self.stdout.write(f'-- {label}\n{plan}\n')
+            if tables:
+                scans.append(label)
+                self.stdout.write(self.style.ERROR(f'{label}: full scan of {", ".join(tables)}'))
+            else:
+                self.stdout.write(f'{label}: ok')
+
+        if scans:
+            raise CommandError(f'{len(scans)} queries fall back to a full table scan: {", ".join(scans)}')
+        self.stdout.write(self.style.SUCCESS('All hot queries are served by indexes.'))
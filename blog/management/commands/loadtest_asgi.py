@@ -0,0 +1,109 @@
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+STARTUP_TIMEOUT = 20
+
+
+def login_cookie(user):
+    # 直接写一条会话，压测请求带着它就是已登录用户
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+
+def fetch(url, headers):
+    request = urllib.request.Request(url, headers=headers)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+            ok = response.status == 200
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return ok, time.perf_counter() - start
+
+
+def wait_until_ready(url, headers, process):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError(f'Server exited with code {process.returncode}')
+        if fetch(url, headers)[0]:
+            return
+        time.sleep(0.2)
+    raise CommandError(f'Server did not answer {url} within {STARTUP_TIMEOUT}s')
+
+
+class Command(BaseCommand):
+    help = 'Load-test a JSON endpoint under uvicorn (ASGI) and gunicorn (WSGI) at the same client concurrency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='User the requests are authenticated as (defaults to the first user)')
+        parser.add_argument('--path', default='/api/notifications/unread/')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--wsgi-threads', type=int, default=4, help='Threads of the single gunicorn worker')
+        parser.add_argument('--port', type=int, default=8765)
+
+    def run_load(self, url, headers, total, concurrency):
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            start = time.perf_counter()
+            results = list(pool.map(lambda _: fetch(url, headers), range(total)))
+            elapsed = time.perf_counter() - start
+        latencies = sorted(latency for ok, latency in results if ok)
+        errors = total - len(latencies)
+        if not latencies:
+            return f'all {total} requests failed'
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1]
+        return (
+            f'{len(latencies) / elapsed:.0f} req/s, '
+            f'p50 {statistics.median(latencies) * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms, {errors} errors'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['username']:
+            users = users.filter(username=options['username'])
+        user = users.first()
+        if user is None:
+            raise CommandError('No user to authenticate as.')
+
+        port = options['port']
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+        headers = {'Cookie': login_cookie(user), 'Host': host}
+        url = f'http://127.0.0.1:{port}{options["path"]}'
+        servers = (
+            ('wsgi (gunicorn)', [
+                sys.executable, '-m', 'gunicorn', 'my_blog_project.wsgi:application',
+                '--workers', '1', '--threads', str(options['wsgi_threads']), '--bind', f'127.0.0.1:{port}',
+            ]),
+            ('asgi (uvicorn)', [
+                sys.executable, '-m', 'uvicorn', 'my_blog_project.asgi:application',
+                '--workers', '1', '--host', '127.0.0.1', '--port', str(port), '--no-access-log',
+            ]),
+        )
+
+        self.stdout.write(f'{options["requests"]} requests to {options["path"]} with {options["concurrency"]} concurrent clients')
+        for label, command in servers:
+            process = subprocess.Popen(command, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_until_ready(url, headers, process)
+                self.stdout.write(f'{label}: {self.run_load(url, headers, options["requests"], options["concurrency"])}')
+            finally:
+                process.terminate()
+                process.wait()
+        self.stdout.write(self.style.SUCCESS('Done.'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from blog.images import optimize_image
+from blog.models import Attachment, Post
+
+class Command(BaseCommand):
+    help = 'Record dimensions and generate srcset variants for image attachments uploaded before optimization'
+
+    def handle(self, *args, **options):
+        processed = 0
+        for attachment in Attachment.objects.filter(width__isnull=True).iterator(chunk_size=100):
+            if not attachment.file.storage.exists(attachment.file.name):
+                continue
+            with attachment.file.open('rb') as upload:
+                optimized = optimize_image(upload)
+            if optimized is None:
+                continue
+            # 原文件已经被文章引用，保持不变，只补充尺寸和较小的变体
+            attachment.width, attachment.height = optimized.source_size
+            with transaction.atomic():
+                attachment.save(update_fields=['width', 'height'])
+                attachment.add_variants(optimized.variants)
+            processed += 1
+
+            posts = Post.objects.filter(text__contains=attachment.file.url).only('id', 'author', 'title', 'text', 'text_html_hash')
+            for post in posts:
+                # 正文没变，但图片多了尺寸和 srcset；经过 save() 推进 updated_at 并清掉页面缓存
+                post.render_text(force=True)
+                post.save(update_fields=Post.RENDERED_FIELDS)
+
+        self.stdout.write(self.style.SUCCESS(f'Optimized {processed} image attachments.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from blog.avatars import refresh_variants
+from blog.models import Profile
+
+class Command(BaseCommand):
+    help = 'Generate pre-sized avatar variants for every profile whose source image changed'
+
+    def handle(self, *args, **options):
+        count = 0
+        for profile in Profile.objects.exclude(avatar='').iterator():
+            if refresh_variants(profile):
+                count += 1
+        self.stdout.write(self.style.SUCCESS(f'Processed {count} avatars.'))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from blog.chunked import purge_stale_uploads
+
+class Command(BaseCommand):
+    help = 'Delete chunked uploads that were abandoned before completion, along with their partial files'
+
+    def handle(self, *args, **options):
+        count = purge_stale_uploads()
+        self.stdout.write(self.style.SUCCESS(f'Purged {count} stale uploads.'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from blog.models import Post
+from blog.search import get_backend
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for all posts'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        count = 0
+        with transaction.atomic():
+            backend.clear()
+            for post in Post.objects.only('id', 'title', 'text', 'text_html').iterator(chunk_size=200):
+                backend.index_post(post)
+                count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} posts with {type(backend).__name__}.'))
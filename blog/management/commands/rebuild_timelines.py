@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from blog.models import Contact
+from blog.timeline import rebuild_timeline
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed home timeline of every user who follows someone'
+
+    def handle(self, *args, **options):
+        user_ids = Contact.objects.values_list('user_from_id', flat=True).distinct().order_by('user_from_id')
+        count = 0
+        for user_id in user_ids.iterator():
+            rebuild_timeline(user_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} timelines.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F
+from blog.models import Post, Comment, recount_likes
+
+class Command(BaseCommand):
+    help = 'Recompute the stored like counters of posts and comments from the like tables'
+
+    def handle(self, *args, **options):
+        for model in (Post, Comment):
+            drifted = list(
+                model.objects.annotate(actual=Count('likes'))
+                .exclude(like_count=F('actual'))
+                .values_list('pk', flat=True)
+            )
+            if drifted:
+                recount_likes(model, drifted)
+            self.stdout.write(self.style.SUCCESS(f'{model.__name__}: fixed {len(drifted)} like counters.'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from blog.models import Post
+
+class Command(BaseCommand):
+    help = 'Re-render the stored Markdown HTML and excerpts of posts whose content or extension config has changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Re-render every post even if its stored HTML is up to date')
+
+    def handle(self, *args, **options):
+        rendered = 0
+        total = 0
+        fields = ('id', 'author', 'title', 'text', 'text_html_hash')
+        for post in Post.objects.only(*fields).iterator(chunk_size=200):
+            total += 1
+            if post.render_text(force=options['force']):
+                # 经过 save() 推进 updated_at，post_save 再清掉整页缓存、重建搜索索引
+                post.save(update_fields=Post.RENDERED_FIELDS)
+                rendered += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Re-rendered {rendered} of {total} posts.'))
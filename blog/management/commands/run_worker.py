@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand
+from blog.chunked import purge_stale_uploads
+from blog.tasks import run_pending
+
+class Command(BaseCommand):
+    help = 'Run the database-backed background task worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--max-tasks', type=int, default=None, help='Exit after running this many tasks')
+        parser.add_argument('--purge-interval', type=float, default=3600.0,
+                            help='Seconds between sweeps of abandoned chunked uploads (0 disables)')
+
+    def handle(self, *args, **options):
+        remaining = options['max_tasks']
+        total = 0
+        next_purge = time.monotonic()
+        self.stdout.write(self.style.SUCCESS('Worker started.'))
+        try:
+            while remaining is None or remaining > 0:
+                if options['purge_interval'] and time.monotonic() >= next_purge:
+                    purge_stale_uploads()
+                    next_purge = time.monotonic() + options['purge_interval']
+                processed = run_pending(max_tasks=remaining)
+                total += processed
+                if remaining is not None:
+                    remaining -= processed
+                if options['once']:
+                    break
+                if not processed:
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Worker stopped after {total} tasks.'))
@@ -0,0 +1,158 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+from .avatars import VARIANT_PREFIX
+from .models import Attachment, AttachmentVariant
+from .storage import BLOB_PREFIX
+
+# 这些路径下的文件名由内容哈希决定，内容永远不会变
+IMMUTABLE_PREFIXES = (BLOB_PREFIX + '/', VARIANT_PREFIX + '/')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+MEDIA_MAX_AGE = 60 * 60
+STREAM_BLOCK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# 只有这些类型按原样内联显示，其余一律作为下载发送，避免上传的网页在本站域名下执行
+INLINE_TYPES = {
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/avif',
+    'video/mp4', 'video/webm', 'video/ogg',
+    'audio/mpeg', 'audio/ogg', 'audio/wav', 'audio/webm', 'audio/mp4', 'audio/flac',
+}
+
+
+def parse_range(header, size):
+    """解析单个字节区间，返回 (start, end)；不支持的写法返回 None，无法满足时抛出 ValueError。"""
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def if_range_matches(request, etag, mtime):
+    value = request.headers.get('If-Range')
+    if not value:
+        return True
+    if value.startswith('"') or value.startswith('W/'):
+        return value == etag
+    return parse_http_date_safe(value) == int(mtime)
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(STREAM_BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def media_type(path):
+    content_type, encoding = mimetypes.guess_type(path)
+    # 压缩包不能声明成 Content-Encoding，否则浏览器会替用户解压；和其他类型一样按下载发送
+    if encoding or content_type not in INLINE_TYPES:
+        return 'application/octet-stream', False
+    return content_type, True
+
+
+def download_name(name):
+    # 附件的 blob 以内容哈希命名，下载时用上传时的文件名
+    attachment = Attachment.objects.filter(file=name).only('name', 'file').first()
+    if attachment is None:
+        variant = AttachmentVariant.objects.filter(file=name).select_related('attachment').first()
+        attachment = variant and variant.attachment
+    return attachment.display_name if attachment else os.path.basename(name)
+
+
+def safety_headers(response, name, inline):
+    # 即使被当成页面打开，sandbox 也让它处于独立的源里，拿不到本站的 cookie 和接口
+    response['Content-Security-Policy'] = 'sandbox'
+    response['X-Content-Type-Options'] = 'nosniff'
+    if not inline:
+        response['Content-Disposition'] = content_disposition_header(True, download_name(name))
+    return response
+
+
+def cache_headers(response, name, etag, mtime):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    response['Accept-Ranges'] = 'bytes'
+    if name.startswith(IMMUTABLE_PREFIXES):
+        response['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response['Cache-Control'] = f'public, max-age={MEDIA_MAX_AGE}'
+    return response
+
+
+def accel_response(name, path, content_type):
+    response = HttpResponse(content_type=content_type)
+    # 交给前端代理直接发送文件，Range 和发送都由代理处理
+    if settings.MEDIA_SERVE_MODE == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + name
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Invalid media path')
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('Media file not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Media file not found')
+
+    name = os.path.relpath(full_path, os.path.abspath(settings.MEDIA_ROOT)).replace(os.sep, '/')
+    etag = quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        return cache_headers(not_modified, name, etag, stat.st_mtime)
+
+    content_type, inline = media_type(full_path)
+    if settings.MEDIA_SERVE_MODE != 'django':
+        response = accel_response(name, full_path, content_type)
+        return cache_headers(safety_headers(response, name, inline), name, etag, stat.st_mtime)
+
+    size = stat.st_size
+    byte_range = None
+    if request.headers.get('Range') and if_range_matches(request, etag, stat.st_mtime):
+        try:
+            byte_range = parse_range(request.headers['Range'], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return cache_headers(response, name, etag, stat.st_mtime)
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type, as_attachment=not inline)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_range(full_path, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    return cache_headers(safety_headers(response, name, inline), name, etag, stat.st_mtime)
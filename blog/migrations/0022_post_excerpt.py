@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+def invalidate_rendered_posts(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    Post.objects.update(text_html_hash='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0021_post_text_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='excerpt_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpt_text',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(invalidate_rendered_posts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-18 10:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_comment_roots(apps, schema_editor):
+    Comment = apps.get_model('blog', 'Comment')
+    parents = dict(Comment.objects.values_list('id', 'parent_id'))
+    roots = {}
+    for comment_id, parent_id in parents.items():
+        if parent_id is None:
+            continue
+        root_id = parent_id
+        while parents.get(root_id) is not None:
+            root_id = parents[root_id]
+        roots.setdefault(root_id, []).append(comment_id)
+    for root_id, comment_ids in roots.items():
+        Comment.objects.filter(id__in=comment_ids).update(root_id=root_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0023_post_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread_replies', to='blog.comment'),
+        ),
+        migrations.RunPython(backfill_comment_roots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-18 10:58
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_like_counts(apps, schema_editor):
+    for model_name, column in (('Post', 'post_id'), ('Comment', 'comment_id')):
+        model = apps.get_model('blog', model_name)
+        counts = model.likes.through.objects.filter(**{column: OuterRef('pk')}) \
+            .values(column).annotate(total=Count('*')).values('total')
+        model.objects.update(like_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0024_comment_root'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_like_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-18 11:09
+
+import os
+
+import blog.storage
+from django.db import migrations, models
+
+
+def backfill_attachment_names(apps, schema_editor):
+    Attachment = apps.get_model('blog', 'Attachment')
+    for attachment in Attachment.objects.filter(name='').only('id', 'file').iterator():
+        Attachment.objects.filter(pk=attachment.pk).update(name=os.path.basename(attachment.file.name)[:255])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0030_attachment_dimensions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='file',
+            field=models.FileField(db_index=True, storage=blog.storage.attachment_storage, upload_to='attachments/%Y/%m/%d/'),
+        ),
+        migrations.AlterField(
+            model_name='attachmentvariant',
+            name='file',
+            field=models.FileField(db_index=True, storage=blog.storage.attachment_storage, upload_to='attachments/%Y/%m/%d/'),
+        ),
+        migrations.RunPython(backfill_attachment_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-18 11:16
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Coalesce
+
+
+def backfill_updated_at(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+    Post.objects.update(updated_at=Coalesce(F('published_date'), F('created_date')))
+    Comment.objects.update(updated_at=F('created_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0032_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-updated_at'], name='post_updated_idx'),
+        ),
+    ]
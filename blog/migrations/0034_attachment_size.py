@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-18 11:18
+
+from django.db import migrations, models
+
+
+def backfill_attachment_sizes(apps, schema_editor):
+    Attachment = apps.get_model('blog', 'Attachment')
+    for attachment in Attachment.objects.filter(size__isnull=True).only('id', 'file').iterator():
+        try:
+            size = attachment.file.size
+        except OSError:
+            continue
+        Attachment.objects.filter(pk=attachment.pk).update(size=size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0033_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='size',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_attachment_sizes, migrations.RunPython.noop),
+    ]
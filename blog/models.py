@@ -1,10 +1,23 @@
-from django.db import models
+import os
+import uuid
+from django.db import models, transaction
 from django.utils import timezone
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.db.models import F, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
 from django.dispatch import receiver
-from PIL import Image
+from .avatars import variant_url, release_variants, DEFAULT_AVATAR_URL
+from .images import optimize_image
+from .storage import attachment_storage
+from .uploads import check_upload_name
+from .rendering import render_markdown, render_excerpt, content_hash
+from . import search
+from .notifications import invalidate_unread_counts, refresh_latest_broadcast_id
+from .pagecache import invalidate_pages, ALL_PAGES
 
 class Tag(models.Model):
     name = models.CharField(max_length=50, unique=True)
@@ -18,36 +31,189 @@ class Post(models.Model):
     text = models.TextField()
     created_date = models.DateTimeField(default=timezone.now)
     published_date = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
     likes = models.ManyToManyField(User, related_name='blog_posts', blank=True)
     tags = models.ManyToManyField(Tag, related_name='posts', blank=True)
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    text_html = models.TextField(blank=True, editable=False)
+    text_html_hash = models.CharField(max_length=64, blank=True, editable=False)
+    excerpt_html = models.TextField(blank=True, editable=False)
+    excerpt_text = models.TextField(blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # 首页按发布时间倒序的键集分页
+            models.Index(fields=['-published_date', '-id'], name='post_published_idx',
+                         condition=models.Q(published_date__isnull=False)),
+            # 个人主页和关注时间线
+            models.Index(fields=['author', '-published_date', '-id'], name='post_author_published_idx'),
+            models.Index(fields=['author', 'created_date'], name='post_author_created_idx'),
+            # 列表页条件请求取最近修改的一篇
+            models.Index(fields=['-updated_at'], name='post_updated_idx'),
+        ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'text' in update_fields:
+            if self.render_text() and update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(self.RENDERED_FIELDS)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'updated_at'}
+        super().save(*args, **kwargs)
+        if kwargs.get('update_fields') is None or 'text_html' in kwargs['update_fields']:
+            # 强制重渲染（比如补上了图片尺寸）时正文的哈希不变，正文片段的键也不变，只能主动删掉
+            key = make_template_fragment_key('post_body', [self.pk, self.text_html_hash])
+            transaction.on_commit(lambda: caches['template_fragments'].delete(key))
+
+    RENDERED_FIELDS = ('text_html', 'text_html_hash', 'excerpt_html', 'excerpt_text')
+
+    def render_text(self, force=False):
+        digest = content_hash(self.text)
+        if not force and digest == self.text_html_hash:
+            return False
+        self.text_html = render_markdown(self.text)
+        self.excerpt_html, self.excerpt_text = render_excerpt(self.text)
+        self.text_html_hash = digest
+        return True
+
+    def rendered_html(self):
+        # 存储的 HTML 过期（扩展配置升级后还没跑 rerender_posts）时只在内存里渲染，读请求不写库
+        if content_hash(self.text) != self.text_html_hash:
+            return render_markdown(self.text)
+        return self.text_html
     
     def publish(self):
         self.published_date = timezone.now()
         self.save()
     
     def total_likes(self):
-        return self.likes.count()
+        return self.like_count
     
     def __str__(self):
         return self.title
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_post(instance)
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
     
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField()
     created_date = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    root = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='thread_replies', editable=False)
     likes = models.ManyToManyField(User, related_name='comment_likes', blank=True)
+    like_count = models.PositiveIntegerField(default=0, editable=False)
     is_read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # 文章下按时间分页的顶层评论
+            models.Index(fields=['post', 'created_date', 'id'], name='comment_root_idx',
+                         condition=models.Q(parent__isnull=True)),
+            # 未读回复只占很小一部分，部分索引只收录它们
+            models.Index(fields=['parent'], name='comment_unread_reply_idx', condition=models.Q(is_read=False)),
+            models.Index(fields=['post'], name='comment_unread_post_idx', condition=models.Q(is_read=False)),
+            models.Index(fields=['author', '-created_date'], name='comment_author_created_idx'),
+        ]
+
     def __str__(self):
         return self.text
+
+    def save(self, *args, **kwargs):
+        if self.parent_id and not self.root_id:
+            self.root_id = self.parent.root_id or self.parent_id
+        super().save(*args, **kwargs)
     
     def total_likes(self):
-        return self.likes.count()
+        return self.like_count
+
+def touch_post(post_id):
+    # 标签、附件这类关联数据变化时也要推进 updated_at，条件请求的校验值才会变化
+    Post.objects.filter(pk=post_id).update(updated_at=timezone.now())
+
+def toggle_like(instance, user):
+    model = type(instance)
+    field = model.likes.field
+    through = model.likes.through
+    lookup = {field.m2m_column_name(): instance.pk, field.m2m_reverse_name(): user.pk}
+    with transaction.atomic():
+        deleted, _ = through.objects.filter(**lookup).delete()
+        if deleted:
+            liked = False
+            model.objects.filter(pk=instance.pk).update(like_count=F('like_count') - deleted, updated_at=timezone.now())
+        else:
+            _, liked = through.objects.get_or_create(**lookup)
+            if liked:
+                model.objects.filter(pk=instance.pk).update(like_count=F('like_count') + 1, updated_at=timezone.now())
+        instance.like_count = model.objects.values_list('like_count', flat=True).get(pk=instance.pk)
+    invalidate_pages(f'post:{instance.pk if model is Post else instance.post_id}')
+    return liked
+
+def recount_likes(model, pks=None):
+    field = model.likes.field
+    counts = model.likes.through.objects.filter(**{field.m2m_column_name(): OuterRef('pk')}) \
+        .values(field.m2m_column_name()).annotate(total=Count('*')).values('total')
+    queryset = model.objects.all() if pks is None else model.objects.filter(pk__in=pks)
+    if pks is None:
+        invalidate_pages(ALL_PAGES)
+    else:
+        post_ids = pks if model is Post else queryset.values_list('post_id', flat=True).distinct()
+        invalidate_pages(*[f'post:{post_id}' for post_id in post_ids])
+    return queryset.update(like_count=Coalesce(Subquery(counts), 0))
+
+@receiver(m2m_changed, sender=Post.likes.through)
+@receiver(m2m_changed, sender=Comment.likes.through)
+def sync_like_count(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # 从用户一侧 clear 时 post_clear 拿不到被清掉的对象，先把它们记下来
+        field = model.likes.field
+        instance.__dict__.setdefault('_cleared_likes', {})[sender] = set(
+            sender.objects.filter(**{field.m2m_reverse_name(): instance.pk})
+            .values_list(field.m2m_column_name(), flat=True)
+        )
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        recount_likes(type(instance), [instance.pk])
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.get('_cleared_likes', {}).pop(sender, None)
+    if pk_set:
+        recount_likes(model, pk_set)
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        invalidate_comment_recipients(instance)
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    invalidate_comment_recipients(instance)
+
+def invalidate_comment_recipients(comment):
+    post_author_id = Post.objects.filter(pk=comment.post_id).values_list('author_id', flat=True).first()
+    parent_author_id = None
+    if comment.parent_id:
+        parent_author_id = Comment.objects.filter(pk=comment.parent_id).values_list('author_id', flat=True).first()
+    invalidate_unread_counts(post_author_id, parent_author_id)
+
+@receiver(pre_delete, sender=User)
+def release_user_likes(sender, instance, **kwargs):
+    # 计数已经偏成 0 的不再减，否则无符号字段会变成负数
+    Post.objects.filter(likes=instance, like_count__gt=0).update(like_count=F('like_count') - 1)
+    Comment.objects.filter(likes=instance, like_count__gt=0).update(like_count=F('like_count') - 1)
     
 class Profile(models.Model):
     GENDER_CHOICES = (
@@ -64,27 +230,78 @@ class Profile(models.Model):
     bio = models.TextField(max_length=500, blank=True, verbose_name="个人简介")
     avatar = models.ImageField(upload_to='avatars/', default='avatars/default.png', blank=True, verbose_name="头像")
     recovery_key = models.CharField(max_length=128, verbose_name="加密恢复密钥")
+    avatar_hash = models.CharField(max_length=64, blank=True, editable=False, db_index=True)
 
     def __str__(self):
         return self.nickname or self.user.username
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = instance._tracked_values()
+        return instance
+
+    def _tracked_values(self):
+        return {
+            field.attname: field.get_prep_value(field.value_from_object(self))
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__ and not field.primary_key
+        }
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return
+        # 延迟字段第一次访问时也走这里，取回的值同样算作加载时的值
+        current = self._tracked_values()
+        if fields is None:
+            self._loaded_values = current
+            return
+        refreshed = {field.attname for field in self._meta.concrete_fields if field.name in fields or field.attname in fields}
+        loaded.update({name: value for name, value in current.items() if name in refreshed})
+
+    def changed_fields(self):
+        """与数据库中已加载的值相比发生变化的字段，加载时被延迟、之后又赋了值的字段也算；未从数据库加载时返回 None。"""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        current = self._tracked_values()
+        changed = [name for name, value in current.items() if name not in loaded or loaded[name] != value]
+        if self.avatar and not self.avatar._committed and 'avatar' not in changed:
+            changed.append('avatar')
+        return changed
+
     def save(self, *args, **kwargs):
+        # 新上传的头像在 super().save() 里才会写入存储，先记下来
+        avatar_uploaded = bool(self.avatar) and not self.avatar._committed
+        replaced_hash = ''
+        if avatar_uploaded:
+            # 变体生成之前先回退到原图，旧图的变体随之作废
+            replaced_hash, self.avatar_hash = self.avatar_hash, ''
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            changed = self.changed_fields()
+            if changed is not None:
+                if not changed:
+                    return
+                if avatar_uploaded and 'avatar_hash' not in changed:
+                    # 内存里的哈希可能是后台任务写进来的，和加载时的值比不出变化
+                    changed.append('avatar_hash')
+                kwargs['update_fields'] = changed
         super().save(*args, **kwargs)
+        self._loaded_values = self._tracked_values()
+        if avatar_uploaded:
+            from .tasks import enqueue
+            transaction.on_commit(lambda: enqueue('process_avatar', profile_id=self.pk))
+            if replaced_hash:
+                transaction.on_commit(lambda: release_variants(replaced_hash))
 
-        if self.avatar:
-            img_path = self.avatar.path
-            img = Image.open(img_path)
-            if img.height > 200 or img.width > 200:
-                width, height = img.size
-                min_side = min(width, height)
-                left = (width - min_side) / 2
-                top = (height - min_side) / 2
-                right = (width + min_side) / 2
-                bottom = (height + min_side) / 2
-
-                img = img.crop((left, top, right, bottom))
-                img.thumbnail((200, 200), Image.LANCZOS)
-                img.save(img_path, quality=85)
+    def avatar_url(self, size=64, ext='webp'):
+        if not self.avatar:
+            return DEFAULT_AVATAR_URL
+        if not self.avatar_hash:
+            return self.avatar.url
+        return variant_url(self.avatar_hash, size, ext)
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -92,16 +309,89 @@ def create_user_profile(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance, nickname=instance.username)
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
+def save_user_profile(sender, instance, created, **kwargs):
+    # 只有通过 user.profile 取出并改动过的资料才需要跟着保存，登录更新 last_login 时不再碰 Profile
+    if created or not User.profile.is_cached(instance):
+        return
     instance.profile.save()
 
 class Attachment(models.Model):
     post = models.ForeignKey(Post, related_name='attachments', on_delete=models.CASCADE, null=True, blank=True)
-    file = models.FileField(upload_to='attachments/%Y/%m/%d/')
+    file = models.FileField(upload_to='attachments/%Y/%m/%d/', storage=attachment_storage, db_index=True)
+    name = models.CharField(max_length=255, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    size = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+
+    def __str__(self):
+        return self.display_name
+
+    def save(self, *args, **kwargs):
+        # 大小在保存时记下来，页面上显示时就不用每次去 stat 文件
+        if self.file and (self.size is None or not self.file._committed):
+            self.size = self.file.size
+        super().save(*args, **kwargs)
+
+    @property
+    def display_name(self):
+        return self.name or os.path.basename(self.file.name)
+
+    @classmethod
+    def from_upload(cls, upload, **kwargs):
+        """图片先压缩成 WebP 并生成 srcset 变体，其余文件原样保存；网页、SVG 这类可执行的文件抛出 ValidationError。"""
+        check_upload_name(upload.name)
+        kwargs.setdefault('name', os.path.basename(upload.name))
+        optimized = optimize_image(upload)
+        # 写 blob 和插入引用它的行放在同一个事务里，删除 blob 时的引用检查才不会漏掉它
+        with transaction.atomic():
+            if optimized is None:
+                return cls.objects.create(file=upload, **kwargs)
+            attachment = cls(width=optimized.width, height=optimized.height, **kwargs)
+            attachment.file.save(optimized.content.name, optimized.content, save=False)
+            attachment.save()
+            attachment.add_variants(optimized.variants)
+        return attachment
+
+    def add_variants(self, variants):
+        for width, content in variants:
+            AttachmentVariant.objects.create(attachment=self, width=width, file=content)
+
+    def srcset(self):
+        variants = self.variant_files.all()
+        if not variants:
+            return ''
+        sources = [f'{variant.file.url} {variant.width}w' for variant in variants]
+        sources.append(f'{self.file.url} {self.width}w')
+        return ', '.join(sources)
+
+class AttachmentVariant(models.Model):
+    """图片附件的 srcset 小尺寸版本；文件和原图一样按内容存放，由 django_cleanup 随行删除。"""
+    attachment = models.ForeignKey(Attachment, related_name='variant_files', on_delete=models.CASCADE)
+    width = models.PositiveIntegerField()
+    file = models.FileField(upload_to='attachments/%Y/%m/%d/', storage=attachment_storage, db_index=True)
+
+    class Meta:
+        ordering = ['width']
+
+    def __str__(self):
+        return f"{self.attachment} @{self.width}w"
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, related_name='upload_sessions', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True)
+    received = models.BigIntegerField(default=0)
+    attachment = models.OneToOneField(Attachment, related_name='upload_session', on_delete=models.SET_NULL, null=True, blank=True)
+    # 正在写分片的请求抢占时记下的时间，同一时刻只有一个请求能动临时文件
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return self.file.name
+        return f"{self.filename} ({self.received}/{self.size})"
 
 class Message(models.Model):
     sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
@@ -115,6 +405,13 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['-sent_at']
+        indexes = [
+            models.Index(fields=['recipient', '-sent_at'], name='message_inbox_idx',
+                         condition=models.Q(deleted_by_recipient=False)),
+            models.Index(fields=['sender', '-sent_at'], name='message_outbox_idx',
+                         condition=models.Q(deleted_by_sender=False)),
+        ]
+
     def __str__(self):
         return f"{self.sender} -> {self.recipient}: {self.subject}"
     
@@ -128,4 +425,174 @@ class Contact(models.Model):
         unique_together = ('user_from', 'user_to')
     
     def __str__(self):
-        return f"{self.user_from} 关注了 {self.user_to}"
\ No newline at end of file
+        return f"{self.user_from} 关注了 {self.user_to}"
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def message_changed(sender, instance, **kwargs):
+    invalidate_unread_counts(instance.recipient_id)
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User, related_name='timeline_entries', on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, related_name='timeline_entries', on_delete=models.CASCADE)
+    published_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [models.Index(fields=['user', '-published_date', '-post'])]
+
+    def __str__(self):
+        return f"{self.user} <- {self.post}"
+
+class Broadcast(models.Model):
+    sender = models.ForeignKey(User, related_name='broadcasts', on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, related_name='broadcasts', on_delete=models.CASCADE, null=True, blank=True)
+    subject = models.CharField(max_length=200)
+    body = models.TextField()
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    is_broadcast = True
+
+    class Meta:
+        ordering = ['-sent_at']
+
+    def __str__(self):
+        return f"{self.sender} -> *: {self.subject}"
+
+    @classmethod
+    def visible_to(cls, user_id):
+        # 只显示关注之后发布的广播
+        return cls.objects.filter(
+            sender__rel_to_set__user_from_id=user_id,
+            sent_at__gte=F('sender__rel_to_set__created'),
+        )
+
+class BroadcastWatermark(models.Model):
+    user = models.OneToOneField(User, related_name='broadcast_watermark', on_delete=models.CASCADE)
+    last_read_id = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user} 已读至 #{self.last_read_id}"
+
+    @classmethod
+    def last_read(cls, user_id):
+        return cls.objects.filter(user_id=user_id).values_list('last_read_id', flat=True).first() or 0
+
+    @classmethod
+    def advance(cls, user_id, broadcast_id):
+        watermark, created = cls.objects.get_or_create(user_id=user_id, defaults={'last_read_id': broadcast_id})
+        if not created:
+            return cls.objects.filter(pk=watermark.pk, last_read_id__lt=broadcast_id).update(last_read_id=broadcast_id)
+        return 1
+
+@receiver(post_save, sender=Broadcast)
+def broadcast_sent(sender, instance, created, raw=False, **kwargs):
+    # 提交之后再公布，否则读到新 id 的请求可能还数不到这条广播
+    if created and not raw:
+        transaction.on_commit(refresh_latest_broadcast_id)
+
+@receiver(post_delete, sender=Broadcast)
+def broadcast_deleted(sender, instance, **kwargs):
+    transaction.on_commit(refresh_latest_broadcast_id)
+
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+def contact_changed(sender, instance, **kwargs):
+    invalidate_unread_counts(instance.user_from_id)
+
+class Task(models.Model):
+    STATUS_CHOICES = (
+        ('pending', '等待中'),
+        ('running', '执行中'),
+        ('done', '已完成'),
+        ('failed', '失败'),
+    )
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['run_after', 'id']
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f"{self.name}#{self.pk} ({self.status})"
+
+    def checkpoint(self, progress=None, total=None, **payload):
+        if progress is not None:
+            self.progress = progress
+        if total is not None:
+            self.total = total
+        self.payload.update(payload)
+        self.save(update_fields=['progress', 'total', 'payload', 'updated_at'])
+
+# 匿名访客整页缓存的失效规则：页面通过 add_cache_tags 声明依赖，这里按数据变化递增对应标签
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_pages_changed(sender, instance, **kwargs):
+    invalidate_pages('posts', f'post:{instance.pk}', f'user:{instance.author_id}')
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def post_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        touch_post(instance.pk)
+        invalidate_pages('posts', f'post:{instance.pk}')
+    elif pk_set is None:
+        invalidate_pages(ALL_PAGES)
+    else:
+        Post.objects.filter(pk__in=pk_set).update(updated_at=timezone.now())
+        invalidate_pages('posts', *[f'post:{pk}' for pk in pk_set])
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def tag_pages_changed(sender, instance, created=False, **kwargs):
+    # 新标签要等到加进文章时才出现在页面上；改名或删除则影响所有用到它的页面
+    if not created:
+        instance.posts.update(updated_at=timezone.now())
+        invalidate_pages(ALL_PAGES)
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_pages_changed(sender, instance, **kwargs):
+    invalidate_pages(f'post:{instance.post_id}', f'user:{instance.author_id}')
+
+@receiver(post_save, sender=Attachment)
+@receiver(post_delete, sender=Attachment)
+def attachment_pages_changed(sender, instance, **kwargs):
+    if instance.post_id:
+        touch_post(instance.post_id)
+        invalidate_pages(f'post:{instance.post_id}')
+
+@receiver(post_save, sender=Profile)
+def profile_pages_changed(sender, instance, created, update_fields=None, **kwargs):
+    invalidate_pages(f'user:{instance.user_id}')
+    if created:
+        return
+    # 这时 _loaded_values 还没更新，changed_fields() 就是这次真正写入的变化
+    fields = set(update_fields) if update_fields is not None else None
+    changed = instance.changed_fields()
+    if changed is not None:
+        fields = set(changed) if fields is None else fields & set(changed)
+    if fields is None or {'nickname', 'avatar', 'avatar_hash'} & fields:
+        # 文章和评论旁边显示作者昵称和头像，让条件请求的校验值跟着变
+        now = timezone.now()
+        Post.objects.filter(author_id=instance.user_id).update(updated_at=now)
+        Comment.objects.filter(author_id=instance.user_id).update(updated_at=now)
+
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+def contact_pages_changed(sender, instance, **kwargs):
+    invalidate_pages(f'user:{instance.user_from_id}', f'user:{instance.user_to_id}')
@@ -0,0 +1,109 @@
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import Max, Q
+
+UNREAD_CACHE_TIMEOUT = 60 * 60
+LATEST_BROADCAST_KEY = 'blog:latest-broadcast'
+
+# 广播是读时扩散的：发布时只记下最新的广播 id，每个用户读取时拿它和自己缓存里记录的比较，
+# 有新广播才用自己的已读水位重数广播这一项，不会让所有人的缓存同时失效
+def refresh_latest_broadcast_id():
+    from .models import Broadcast
+
+    latest = Broadcast.objects.aggregate(latest=Max('id'))['latest'] or 0
+    cache.set(LATEST_BROADCAST_KEY, latest, None)
+    return latest
+
+def latest_broadcast_id():
+    latest = cache.get(LATEST_BROADCAST_KEY)
+    if latest is None:
+        latest = refresh_latest_broadcast_id()
+    return latest
+
+async def alatest_broadcast_id():
+    latest = await cache.aget(LATEST_BROADCAST_KEY)
+    if latest is None:
+        latest = await sync_to_async(refresh_latest_broadcast_id)()
+    return latest
+
+def unread_cache_key(user_id):
+    return f'blog:unread:{user_id}'
+
+def unread_querysets(user_id):
+    from .models import Comment, Message
+
+    return {
+        'comments': Comment.objects.filter(
+            Q(post__author_id=user_id) | Q(parent__author_id=user_id), is_read=False
+        ).exclude(author_id=user_id).distinct(),
+        'messages': Message.objects.filter(
+            recipient_id=user_id,
+            is_read=False,
+            deleted_by_recipient=False
+        ),
+    }
+
+def unread_broadcasts(user_id, last_read_id):
+    from .models import Broadcast
+
+    return Broadcast.visible_to(user_id).filter(id__gt=last_read_id)
+
+def count_broadcasts(user_id, latest):
+    from .models import BroadcastWatermark
+
+    last_read = BroadcastWatermark.last_read(user_id)
+    # 已读水位追上了最新的广播，不用再数
+    if last_read >= latest:
+        return 0
+    return unread_broadcasts(user_id, last_read).count()
+
+async def acount_broadcasts(user_id, latest):
+    from .models import BroadcastWatermark
+
+    last_read = await BroadcastWatermark.objects.filter(user_id=user_id) \
+        .values_list('last_read_id', flat=True).afirst() or 0
+    if last_read >= latest:
+        return 0
+    return await unread_broadcasts(user_id, last_read).acount()
+
+def compute_unread_counts(user_id, latest):
+    counts = {name: queryset.count() for name, queryset in unread_querysets(user_id).items()}
+    counts['broadcasts'] = count_broadcasts(user_id, latest)
+    return counts
+
+async def acompute_unread_counts(user_id, latest):
+    counts = {name: await queryset.acount() for name, queryset in unread_querysets(user_id).items()}
+    counts['broadcasts'] = await acount_broadcasts(user_id, latest)
+    return counts
+
+def get_unread_counts(user_id):
+    key = unread_cache_key(user_id)
+    # 先取最新广播 id 再计数，计数期间新发的广播会在下次读取时补上
+    latest = latest_broadcast_id()
+    entry = cache.get(key)
+    if entry is None:
+        counts = compute_unread_counts(user_id, latest)
+    elif entry['latest_broadcast'] != latest:
+        counts = dict(entry['counts'], broadcasts=count_broadcasts(user_id, latest))
+    else:
+        return entry['counts']
+    cache.set(key, {'counts': counts, 'latest_broadcast': latest}, UNREAD_CACHE_TIMEOUT)
+    return counts
+
+async def aget_unread_counts(user_id):
+    key = unread_cache_key(user_id)
+    latest = await alatest_broadcast_id()
+    entry = await cache.aget(key)
+    if entry is None:
+        counts = await acompute_unread_counts(user_id, latest)
+    elif entry['latest_broadcast'] != latest:
+        counts = dict(entry['counts'], broadcasts=await acount_broadcasts(user_id, latest))
+    else:
+        return entry['counts']
+    await cache.aset(key, {'counts': counts, 'latest_broadcast': latest}, UNREAD_CACHE_TIMEOUT)
+    return counts
+
+def invalidate_unread_counts(*user_ids):
+    keys = [unread_cache_key(user_id) for user_id in set(user_ids) if user_id]
+    if keys:
+        cache.delete_many(keys)
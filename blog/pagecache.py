@@ -0,0 +1,122 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import caches
+from django.db import transaction
+
+PAGE_CACHE_ALIAS = 'pages'
+PAGE_CACHE_TIMEOUT = 10 * 60
+# 每个缓存页面都隐式依赖这个标签，递增它即可清空全部页面
+ALL_PAGES = 'all'
+METRICS = ('hit', 'miss', 'store', 'bypass')
+
+
+def page_cache():
+    return caches[PAGE_CACHE_ALIAS]
+
+
+def page_key(request):
+    path = request.get_full_path()
+    return 'blog:page:' + hashlib.md5(path.encode('utf-8')).hexdigest()
+
+
+def tag_key(tag):
+    return f'blog:page-tag:{tag}'
+
+
+def tag_versions(tags):
+    cache = page_cache()
+    keys = {tag_key(tag): tag for tag in tags}
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, tag in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = time.time_ns()
+            cache.add(key, version, None)
+            version = cache.get(key, version)
+        versions[tag] = version
+    return versions
+
+
+def add_cache_tags(request, *tags):
+    """声明当前页面依赖的数据；版本号在读取数据之前记下，渲染期间发生的修改会让这份缓存立即失效。"""
+    known = getattr(request, '_page_cache_tags', None)
+    if known is None:
+        return
+    new_tags = [tag for tag in tags if tag not in known]
+    if new_tags:
+        known.update(tag_versions(new_tags))
+
+
+def invalidate_pages(*tags):
+    tags = {tag for tag in tags if tag}
+
+    def bump():
+        cache = page_cache()
+        for tag in tags:
+            try:
+                cache.incr(tag_key(tag))
+            except ValueError:
+                cache.set(tag_key(tag), time.time_ns(), None)
+
+    if tags:
+        transaction.on_commit(bump)
+
+
+def record(metric):
+    cache = page_cache()
+    key = f'blog:page-metrics:{metric}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def page_cache_stats():
+    cache = page_cache()
+    found = cache.get_many([f'blog:page-metrics:{metric}' for metric in METRICS])
+    stats = {metric: found.get(f'blog:page-metrics:{metric}', 0) for metric in METRICS}
+    lookups = stats['hit'] + stats['miss']
+    stats['hit_ratio'] = round(stats['hit'] / lookups, 4) if lookups else None
+    return stats
+
+
+def is_cacheable(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        # 页面里用到了 CSRF token，就是给这一位访客的，不能共享
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+        and not response.has_header('Cache-Control')
+    )
+
+
+def cache_anonymous_page(view):
+    """匿名访客的整页缓存，按路径和查询串区分，由 add_cache_tags 声明的依赖精确失效。"""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated or 'messages' in request.COOKIES:
+            record('bypass')
+            return view(request, *args, **kwargs)
+
+        cache = page_cache()
+        key = page_key(request)
+        entry = cache.get(key)
+        if entry is not None and tag_versions(entry['tags']) == entry['tags']:
+            record('hit')
+            return entry['response']
+
+        record('miss')
+        request._page_cache_tags = tag_versions([ALL_PAGES])
+        response = view(request, *args, **kwargs)
+        if len(request._page_cache_tags) > 1 and is_cacheable(request, response):
+            cache.set(key, {'tags': request._page_cache_tags, 'response': response}, PAGE_CACHE_TIMEOUT)
+            record('store')
+        return response
+
+    return wrapper
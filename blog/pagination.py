@@ -0,0 +1,79 @@
+import base64
+import binascii
+import hashlib
+import json
+from datetime import datetime
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+COUNT_CACHE_TIMEOUT = 5 * 60
+
+def encode_cursor(*values):
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+def decode_keyset(token):
+    values = decode_cursor(token)
+    if not values or len(values) != 2 or not isinstance(values[1], int):
+        return None
+    position = parse_datetime(str(values[0]))
+    if position is None:
+        return None
+    return position, values[1]
+
+def _after(queryset, date_field, id_field, position, lookup):
+    value, pk = position
+    return queryset.filter(
+        Q(**{f'{date_field}__{lookup}': value}) | Q(**{date_field: value, f'{id_field}__{lookup}': pk})
+    )
+
+def keyset_window(queryset, date_field, id_field, after=None, before=None, limit=10, descending=True):
+    forward = ([f'-{date_field}', f'-{id_field}'], 'lt') if descending else ([date_field, id_field], 'gt')
+    backward = ([date_field, id_field], 'gt') if descending else ([f'-{date_field}', f'-{id_field}'], 'lt')
+
+    def token(item):
+        return encode_cursor(getattr(item, date_field), getattr(item, id_field))
+
+    before_position = decode_keyset(before)
+    if before_position:
+        ordering, lookup = backward
+        items = list(_after(queryset, date_field, id_field, before_position, lookup).order_by(*ordering)[:limit + 1])
+        has_previous = len(items) > limit
+        items = items[:limit][::-1]
+        previous_cursor = token(items[0]) if has_previous else None
+        next_cursor = token(items[-1]) if items else None
+        return items, next_cursor, previous_cursor
+
+    ordering, lookup = forward
+    after_position = decode_keyset(after)
+    if after_position:
+        queryset = _after(queryset, date_field, id_field, after_position, lookup)
+    items = list(queryset.order_by(*ordering)[:limit + 1])
+    has_next = len(items) > limit
+    items = items[:limit]
+    next_cursor = token(items[-1]) if has_next else None
+    previous_cursor = token(items[0]) if after_position and items else None
+    return items, next_cursor, previous_cursor
+
+def keyset_page(queryset, date_field, id_field, cursor=None, limit=10, descending=True):
+    items, next_cursor, _ = keyset_window(queryset, date_field, id_field, after=cursor, limit=limit, descending=descending)
+    return items, next_cursor
+
+def cached_count(queryset, key, timeout=COUNT_CACHE_TIMEOUT):
+    key = 'blog:count:' + hashlib.md5(key.encode('utf-8')).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
\ No newline at end of file
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import re
+from urllib.parse import unquote
+
+import markdown
+import pygments
+from django.apps import apps
+from django.conf import settings
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+
+from .images import IMAGE_SIZES
+
+MARKDOWN_EXTENSIONS = [
+    'markdown.extensions.extra',
+    'markdown.extensions.codehilite',
+    'markdown.extensions.toc',
+]
+
+MARKDOWN_EXTENSION_CONFIGS = {}
+
+MEDIA_IMAGE_VERSION = 1
+
+
+class MediaImageProcessor(Treeprocessor):
+    def run(self, root):
+        images = list(root.iter('img'))
+        by_name = {}
+        for img in images:
+            img.set('loading', 'lazy')
+            img.set('decoding', 'async')
+            src = img.get('src', '')
+            if src.startswith(settings.MEDIA_URL):
+                by_name.setdefault(unquote(src[len(settings.MEDIA_URL):]), []).append(img)
+        if not by_name:
+            return
+        # 上传时记录的尺寸用来预留版面，避免图片加载后页面跳动
+        Attachment = apps.get_model('blog', 'Attachment')
+        attachments = Attachment.objects.filter(file__in=list(by_name), width__isnull=False).prefetch_related('variant_files')
+        for attachment in attachments:
+            for img in by_name[attachment.file.name]:
+                img.set('width', str(attachment.width))
+                img.set('height', str(attachment.height))
+                srcset = attachment.srcset()
+                if srcset:
+                    img.set('srcset', srcset)
+                    img.set('sizes', IMAGE_SIZES)
+
+
+class MediaImageExtension(Extension):
+    def extendMarkdown(self, md):
+        md.treeprocessors.register(MediaImageProcessor(md), 'media_images', 0)
+
+# 渲染结果取决于扩展配置和库版本，任一变化都应让已存储的 HTML 失效
+RENDER_SIGNATURE = json.dumps({
+    'extensions': MARKDOWN_EXTENSIONS,
+    'configs': MARKDOWN_EXTENSION_CONFIGS,
+    'markdown': markdown.__version__,
+    'pygments': pygments.__version__,
+    'media_images': MEDIA_IMAGE_VERSION,
+}, sort_keys=True)
+
+
+def render_markdown(text):
+    return markdown.markdown(
+        text or '',
+        extensions=[*MARKDOWN_EXTENSIONS, MediaImageExtension()],
+        extension_configs=MARKDOWN_EXTENSION_CONFIGS,
+    )
+
+
+def content_hash(text):
+    digest = hashlib.sha256(RENDER_SIGNATURE.encode('utf-8'))
+    digest.update((text or '').encode('utf-8'))
+    return digest.hexdigest()
+
+
+EXCERPT_WORDS = 50
+EXCERPT_MAX_CHARS = 1200
+_FENCE_RE = re.compile(r'^\s*(```|~~~)')
+
+
+def leading_blocks(text, max_words=EXCERPT_WORDS, max_chars=EXCERPT_MAX_CHARS):
+    blocks, current, fence = [], [], None
+    words = chars = 0
+    for line in (text or '').splitlines():
+        match = _FENCE_RE.match(line)
+        if match:
+            if fence is None:
+                fence = match.group(1)
+            elif match.group(1) == fence:
+                fence = None
+        current.append(line)
+        if fence is None and not line.strip():
+            block = '\n'.join(current).strip('\n')
+            current = []
+            if not block:
+                continue
+            blocks.append(block)
+            words += len(block.split())
+            chars += len(block)
+            if words >= max_words or chars >= max_chars:
+                return '\n\n'.join(blocks)
+    if current:
+        blocks.append('\n'.join(current).strip('\n'))
+    return '\n\n'.join(blocks)
+
+
+def render_excerpt(text, max_words=EXCERPT_WORDS):
+    html = Truncator(render_markdown(leading_blocks(text, max_words))).words(max_words, html=True)
+    plain = ' '.join(strip_tags(html).split())
+    return html, plain
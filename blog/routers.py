@@ -0,0 +1,97 @@
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'db_pinned'
+# 为 True 时本次请求（或命令）的读也走主库
+pinned_to_primary = ContextVar('pinned_to_primary', default=False)
+wrote_to_primary = ContextVar('wrote_to_primary', default=False)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica')]
+
+
+def reset_pinning(tokens):
+    """把两个上下文变量恢复到 set() 之前的值，tokens 是两次 set() 的返回值。"""
+    pinned_token, wrote_token = tokens
+    pinned_to_primary.reset(pinned_token)
+    wrote_to_primary.reset(wrote_token)
+
+
+class PrimaryReplicaRouter:
+    """读请求分散到只读副本，写入总是去主库；写过之后的一段时间内读也留在主库，保证读到自己的写入。"""
+
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        if not replicas or pinned_to_primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        # 副本上还没同步到的会话会被当成不存在，SessionMiddleware 随即删掉 cookie，用户就被登出了；
+        # 数据库缓存刚写入的条目在副本上同样读不到，会被当成未命中
+        if model._meta.app_label in ('sessions', 'django_cache'):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # 数据库缓存表的读写不算用户的写入
+        if model._meta.app_label != 'django_cache':
+            pinned_to_primary.set(True)
+            wrote_to_primary.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 副本和主库是同一份数据，跨别名的关联没有问题
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # 副本的表结构由复制同步过来
+        if db in replica_aliases():
+            return False
+        return None
+
+
+class ReadYourWritesMiddleware:
+    """有写入的请求给浏览器留一个短期 cookie，带着它的后续请求都从主库读。"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            # 异步视图前面不能有只支持同步的中间件，否则每个请求又要占一个线程
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not replica_aliases():
+            return self.get_response(request)
+        tokens = self.start(request)
+        try:
+            return self.finish(self.get_response(request))
+        finally:
+            reset_pinning(tokens)
+
+    async def __acall__(self, request):
+        if not replica_aliases():
+            return await self.get_response(request)
+        tokens = self.start(request)
+        try:
+            return self.finish(await self.get_response(request))
+        finally:
+            reset_pinning(tokens)
+
+    def start(self, request):
+        pinned = PIN_COOKIE in request.COOKIES or request.method not in ('GET', 'HEAD', 'OPTIONS')
+        return pinned_to_primary.set(pinned), wrote_to_primary.set(False)
+
+    def finish(self, response):
+        if wrote_to_primary.get():
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.DATABASE_REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,368 @@
+import html
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape, strip_tags
+from django.utils.safestring import mark_safe
+
+from .pagination import decode_cursor, encode_cursor, keyset_window
+
+SQLITE_TABLE = 'blog_post_fts'
+POSTGRES_TABLE = 'blog_post_search'
+
+_CJK = '\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af\uff00-\uffef'
+_CJK_RE = re.compile(f'([{_CJK}])')
+# 把分词时插入的空格去掉，同时保留高亮标记
+_CJK_GAP_RE = re.compile(f'(?:(?<=[{_CJK}])|(?<=[{_CJK}]\x03))\\s+(?=\x02?[{_CJK}])')
+
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+
+def segment(text):
+    # FTS 的 unicode61 分词器不会切分中文，这里把每个汉字当作一个词
+    return ' '.join(_CJK_RE.sub(r' \1 ', text or '').split())
+
+
+def document_for(post):
+    # 渲染后的 HTML 里 & < 和引号都是实体，不还原的话 "AT&T" 会被索引成 "AT amp T"
+    return segment(post.title), segment(html.unescape(strip_tags(post.text_html or post.text)))
+
+
+def highlight(snippet):
+    text = escape(_CJK_GAP_RE.sub('', snippet or ''))
+    return mark_safe(text.replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+def query_terms(query):
+    return [segment(term) for term in (query or '').split() if segment(term)]
+
+
+def decode_rank_cursor(token):
+    values = decode_cursor(token)
+    if not values or len(values) != 2 or not isinstance(values[1], int):
+        return None
+    if isinstance(values[0], bool) or not isinstance(values[0], (int, float)):
+        return None
+    return float(values[0]), values[1]
+
+
+class SearchResults:
+    def __init__(self, backend, query, queryset, tag=None, published_before=None):
+        self.backend = backend
+        self.query = query
+        self.queryset = queryset
+        self.tag = tag
+        self.published_before = published_before
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.backend.count(self)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        if index.stop is None:
+            limit = max(self.count() - start, 0)
+        else:
+            limit = max(index.stop - start, 0)
+        if not limit:
+            return []
+        rows = self.backend.fetch(self, limit, start)
+        posts = self.queryset.in_bulk([row[0] for row in rows])
+        results = []
+        for post_id, rank, snippet in rows:
+            post = posts.get(post_id)
+            if post is None:
+                continue
+            post.search_rank = rank
+            post.search_snippet = highlight(snippet)
+            results.append(post)
+        return results
+
+
+class BaseSearchBackend:
+    def search(self, query, queryset, tag=None, published_before=None):
+        return SearchResults(self, query, queryset, tag=tag, published_before=published_before)
+
+    def add_snippets(self, query, posts):
+        snippets = dict(self.snippets(query, [post.pk for post in posts])) if posts else {}
+        for post in posts:
+            post.search_snippet = highlight(snippets.get(post.pk, ''))
+        return posts
+
+    def _filters(self, results):
+        from .models import Post
+
+        join, join_params, where, where_params = '', [], '', []
+        if results.tag is not None:
+            join = f'JOIN {Post.tags.through._meta.db_table} pt ON pt.post_id = p.id AND pt.tag_id = %s'
+            join_params.append(results.tag.pk)
+        if results.published_before is not None:
+            where = ' AND p.published_date <= %s'
+            where_params.append(results.published_before)
+        return join, join_params, where, where_params
+
+    def _run(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def window(self, results, after=None, before=None, limit=10):
+        """按相关度 (score, id) 做 keyset 分页，返回 (文章, 下一页游标, 上一页游标)；分数越高越靠前。"""
+        ranked = self.ranked_sql(results)
+        if ranked is None:
+            return [], None, None
+        sql, params = ranked
+        before_position = decode_rank_cursor(before)
+        position = before_position or decode_rank_cursor(after)
+        backward = before_position is not None
+        ordering, lookup = ('score, id', '>') if backward else ('score DESC, id DESC', '<')
+        where = ''
+        if position:
+            score, pk = position
+            where = f' WHERE score {lookup} %s OR (score = %s AND id {lookup} %s)'
+            params = [*params, score, score, pk]
+        rows = self._run(f'SELECT id, score FROM ({sql}) ranked{where} ORDER BY {ordering} LIMIT %s', [*params, limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+
+        def token(row):
+            return encode_cursor(row[1], row[0])
+
+        if backward:
+            next_cursor = token(rows[-1]) if rows else None
+            previous_cursor = token(rows[0]) if has_more else None
+        else:
+            next_cursor = token(rows[-1]) if has_more else None
+            previous_cursor = token(rows[0]) if position and rows else None
+
+        posts = results.queryset.in_bulk([row[0] for row in rows])
+        items = []
+        for post_id, score in rows:
+            post = posts.get(post_id)
+            if post is None:
+                continue
+            post.search_rank = score
+            items.append(post)
+        return self.add_snippets(results.query, items), next_cursor, previous_cursor
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    def match_expression(self, query):
+        phrases = []
+        for term in query_terms(query):
+            phrase = '"%s"' % term.replace('"', '""')
+            # 英文词允许前缀匹配，接近原来 icontains 的体验
+            if not _CJK_RE.search(term):
+                phrase += '*'
+            phrases.append(phrase)
+        return ' '.join(phrases)
+
+    def _sql(self, select, results, select_params=()):
+        from .models import Post
+
+        join, join_params, where, where_params = self._filters(results)
+        sql = (
+            f'SELECT {select} FROM {SQLITE_TABLE} '
+            f'JOIN {Post._meta.db_table} p ON p.id = {SQLITE_TABLE}.rowid {join} '
+            f'WHERE {SQLITE_TABLE} MATCH %s{where}'
+        )
+        return sql, [*select_params, *join_params, self.match_expression(results.query), *where_params]
+
+    def count(self, results):
+        if not self.match_expression(results.query):
+            return 0
+        sql, params = self._sql('COUNT(*)', results)
+        return self._run(sql, params)[0][0]
+
+    def ranked_sql(self, results):
+        if not self.match_expression(results.query):
+            return None
+        # bm25 越小越相关，取负数后和 PostgreSQL 的 ts_rank_cd 一样按分数从高到低排
+        return self._sql(f'p.id AS id, -bm25({SQLITE_TABLE}, 10.0, 1.0) AS score', results)
+
+    def fetch(self, results, limit, offset):
+        select = f'p.id, bm25({SQLITE_TABLE}, 10.0, 1.0) AS rank, snippet({SQLITE_TABLE}, 1, %s, %s, %s, 32)'
+        sql, params = self._sql(select, results, [MARK_START, MARK_END, '…'])
+        return self._run(f'{sql} ORDER BY rank LIMIT %s OFFSET %s', params + [limit, offset])
+
+    def filter_queryset(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s', [expression]))
+
+    def snippets(self, query, post_ids):
+        placeholders = ', '.join(['%s'] * len(post_ids))
+        return self._run(
+            f'SELECT rowid, snippet({SQLITE_TABLE}, 1, %s, %s, %s, 32) FROM {SQLITE_TABLE} '
+            f'WHERE {SQLITE_TABLE} MATCH %s AND rowid IN ({placeholders})',
+            [MARK_START, MARK_END, '…', self.match_expression(query), *post_ids],
+        )
+
+    def index_post(self, post):
+        title, body = document_for(post)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s', [post.pk])
+            cursor.execute(f'INSERT INTO {SQLITE_TABLE} (rowid, title, body) VALUES (%s, %s, %s)', [post.pk, title, body])
+
+    def remove_post(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s', [post_id])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE}')
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    def tsquery_text(self, query):
+        return ' '.join('"%s"' % term.replace('"', ' ') for term in query_terms(query))
+
+    def _sql(self, select, results, select_params=()):
+        from .models import Post
+
+        join, join_params, where, where_params = self._filters(results)
+        sql = (
+            f"SELECT {select} FROM {POSTGRES_TABLE} s "
+            f"JOIN {Post._meta.db_table} p ON p.id = s.post_id {join} "
+            f"CROSS JOIN websearch_to_tsquery('simple', %s) q "
+            f"WHERE s.document @@ q{where}"
+        )
+        return sql, [*select_params, *join_params, self.tsquery_text(results.query), *where_params]
+
+    def count(self, results):
+        if not self.tsquery_text(results.query):
+            return 0
+        sql, params = self._sql('COUNT(*)', results)
+        return self._run(sql, params)[0][0]
+
+    def ranked_sql(self, results):
+        if not self.tsquery_text(results.query):
+            return None
+        return self._sql('p.id AS id, ts_rank_cd(s.document, q) AS score', results)
+
+    def fetch(self, results, limit, offset):
+        select = "p.id, ts_rank_cd(s.document, q) AS rank, ts_headline('simple', s.body, q, %s)"
+        options = f'StartSel={MARK_START}, StopSel={MARK_END}, MaxFragments=1, MaxWords=32, MinWords=12'
+        sql, params = self._sql(select, results, [options])
+        return self._run(f'{sql} ORDER BY rank DESC, p.id DESC LIMIT %s OFFSET %s', params + [limit, offset])
+
+    def filter_queryset(self, queryset, query):
+        text = self.tsquery_text(query)
+        if not text:
+            return queryset.none()
+        return queryset.filter(pk__in=RawSQL(
+            f"SELECT post_id FROM {POSTGRES_TABLE} WHERE document @@ websearch_to_tsquery('simple', %s)", [text]
+        ))
+
+    def snippets(self, query, post_ids):
+        options = f'StartSel={MARK_START}, StopSel={MARK_END}, MaxFragments=1, MaxWords=32, MinWords=12'
+        return self._run(
+            f"SELECT post_id, ts_headline('simple', body, websearch_to_tsquery('simple', %s), %s) "
+            f"FROM {POSTGRES_TABLE} WHERE post_id = ANY(%s)",
+            [self.tsquery_text(query), options, list(post_ids)],
+        )
+
+    def index_post(self, post):
+        title, body = document_for(post)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {POSTGRES_TABLE} (post_id, body, document) VALUES "
+                f"(%s, %s, setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B')) "
+                f"ON CONFLICT (post_id) DO UPDATE SET body = EXCLUDED.body, document = EXCLUDED.document",
+                [post.pk, body, title, body],
+            )
+
+    def remove_post(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {POSTGRES_TABLE} WHERE post_id = %s', [post_id])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {POSTGRES_TABLE}')
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    def filter_queryset(self, queryset, query):
+        for term in (query or '').split():
+            queryset = queryset.filter(Q(title__icontains=term) | Q(text__icontains=term))
+        return queryset
+
+    def snippets(self, query, post_ids):
+        return []
+
+    def _queryset(self, results):
+        posts = self.filter_queryset(results.queryset, results.query)
+        if results.tag is not None:
+            posts = posts.filter(tags=results.tag)
+        if results.published_before is not None:
+            posts = posts.filter(published_date__lte=results.published_before)
+        return posts
+
+    def count(self, results):
+        return self._queryset(results).count()
+
+    def fetch(self, results, limit, offset):
+        ids = self._queryset(results).order_by('-published_date').values_list('id', flat=True)[offset:offset + limit]
+        return [(post_id, 0, '') for post_id in ids]
+
+    def window(self, results, after=None, before=None, limit=10):
+        # 没有全文索引时不计算相关度，按发布时间分页
+        return keyset_window(self._queryset(results), 'published_date', 'id', after=after, before=before, limit=limit)
+
+    def index_post(self, post):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def clear(self):
+        pass
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend():
+    return BACKENDS.get(connection.vendor, SimpleSearchBackend)()
+
+
+def search_posts(query, queryset, tag=None, published_before=None):
+    return get_backend().search(query, queryset, tag=tag, published_before=published_before)
+
+
+def search_window(query, queryset, tag=None, published_before=None, after=None, before=None, limit=10):
+    backend = get_backend()
+    results = backend.search(query, queryset, tag=tag, published_before=published_before)
+    return backend.window(results, after=after, before=before, limit=limit)
+
+
+def filter_posts(query, queryset):
+    return get_backend().filter_queryset(queryset, query)
+
+
+def add_snippets(query, posts):
+    return get_backend().add_snippets(query, posts)
+
+
+def index_post(post):
+    get_backend().index_post(post)
+
+
+def remove_post(post_id):
+    get_backend().remove_post(post_id)
@@ -0,0 +1,80 @@
+import hashlib
+import os
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+
+BLOB_PREFIX = 'attachments/blobs'
+
+
+def content_digest(content):
+    # 上传处理器在接收数据时已经算好哈希，这里只在缺失时补算
+    digest = getattr(content, 'sha256', None)
+    if digest:
+        return digest
+    sha = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        sha.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return sha.hexdigest()
+
+
+def blob_name(digest, ext=''):
+    return f'{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}'
+
+
+def lock_blob(name):
+    """在当前事务结束前锁住一个 blob，"确认文件存在后插入引用"和"确认没有引用后删除文件"互斥。"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            key = int.from_bytes(hashlib.sha256(name.encode('utf-8')).digest()[:8], 'big', signed=True)
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [key])
+        else:
+            # SQLite 同一时刻只有一个写事务，拿到写锁就等于锁住了所有 blob
+            table = apps.get_model('blog', 'Attachment')._meta.db_table
+            cursor.execute(f'UPDATE {table} SET id = id WHERE 0 = 1')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """按内容哈希存放附件：同样的文件只落盘一次，被所有引用它的 Attachment 共享。"""
+
+    def save(self, name, content, max_length=None):
+        # 调用方要在同一个事务里插入引用这个 blob 的行，见 Attachment.from_upload
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        target = blob_name(content_digest(content), os.path.splitext(name)[1])
+        lock_blob(target)
+        if self.exists(target):
+            return target
+        saved = self._save(target, content)
+        if saved != target:
+            # 并发上传了同一个文件，对方已经写好，丢掉自己这份
+            super().delete(saved)
+        return target
+
+    def is_referenced(self, name):
+        Attachment = apps.get_model('blog', 'Attachment')
+        AttachmentVariant = apps.get_model('blog', 'AttachmentVariant')
+        return Attachment.objects.filter(file=name).exists() or AttachmentVariant.objects.filter(file=name).exists()
+
+    def delete(self, name):
+        # django_cleanup 在行删除或换文件后调用这里，仍有别的附件引用时保留文件
+        with transaction.atomic():
+            lock_blob(name)
+            if self.is_referenced(name):
+                return
+            super().delete(name)
+
+
+attachment_storage_instance = ContentAddressedStorage()
+
+
+def attachment_storage():
+    return attachment_storage_instance
@@ -0,0 +1,150 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .avatars import refresh_variants
+from .models import Contact, Message, Post, Profile, Task
+from .timeline import push_post, rebuild_timeline
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+FANOUT_BATCH_SIZE = 500
+LOCK_TIMEOUT = timedelta(minutes=10)
+RETRY_DELAY = timedelta(seconds=30)
+
+
+def task(func):
+    TASKS[func.__name__] = func
+    return func
+
+
+def enqueue(name, **payload):
+    if name not in TASKS:
+        raise KeyError(f'Unknown task: {name}')
+    return Task.objects.create(name=name, payload=payload)
+
+
+def fail_abandoned_tasks(now):
+    # 锁超时说明执行它的 worker 已经崩溃，认领时已经计过一次尝试；次数用完的不再重领，和 run_task 一样标记为失败
+    return Task.objects.filter(
+        status='running', locked_at__lt=now - LOCK_TIMEOUT, attempts__gte=F('max_attempts'),
+    ).update(status='failed', locked_at=None, last_error='Worker lock expired', updated_at=now)
+
+
+def claim_next_task():
+    now = timezone.now()
+    fail_abandoned_tasks(now)
+    ready = Task.objects.filter(
+        Q(status='pending') | Q(status='running', locked_at__lt=now - LOCK_TIMEOUT, attempts__lt=F('max_attempts')),
+        run_after__lte=now,
+    ).order_by('run_after', 'id')
+    if connection.features.has_select_for_update_skip_locked:
+        # PostgreSQL：直接锁住第一条没被别的 worker 锁住的任务，不用抢占失败再重试
+        with transaction.atomic():
+            task_obj = ready.select_for_update(skip_locked=True).first()
+            if task_obj is None:
+                return None
+            task_obj.status = 'running'
+            task_obj.locked_at = now
+            task_obj.attempts += 1
+            task_obj.save(update_fields=['status', 'locked_at', 'attempts', 'updated_at'])
+            return task_obj
+    while True:
+        candidate = ready.values('pk', 'status', 'locked_at').first()
+        if candidate is None:
+            return None
+        # 并发的 worker 以条件 UPDATE 抢占任务，失败就换下一个
+        claimed = Task.objects.filter(
+            pk=candidate['pk'], status=candidate['status'], locked_at=candidate['locked_at'],
+        ).update(status='running', locked_at=now, attempts=F('attempts') + 1)
+        if claimed:
+            return Task.objects.get(pk=candidate['pk'])
+
+
+def run_task(task_obj):
+    func = TASKS.get(task_obj.name)
+    try:
+        if func is None:
+            raise KeyError(f'Unknown task: {task_obj.name}')
+        func(task_obj)
+    except Exception:
+        task_obj.last_error = traceback.format_exc()
+        if task_obj.attempts >= task_obj.max_attempts:
+            task_obj.status = 'failed'
+            logger.exception('Task %s failed permanently', task_obj)
+        else:
+            task_obj.status = 'pending'
+            task_obj.run_after = timezone.now() + RETRY_DELAY * (2 ** (task_obj.attempts - 1))
+            logger.warning('Task %s failed, retrying at %s', task_obj, task_obj.run_after)
+    else:
+        task_obj.status = 'done'
+    task_obj.locked_at = None
+    task_obj.save(update_fields=['status', 'run_after', 'last_error', 'locked_at', 'updated_at'])
+    return task_obj.status == 'done'
+
+
+def run_pending(max_tasks=None):
+    processed = 0
+    while max_tasks is None or processed < max_tasks:
+        task_obj = claim_next_task()
+        if task_obj is None:
+            break
+        run_task(task_obj)
+        processed += 1
+    return processed
+
+
+@task
+def push_post_to_timelines(task_obj):
+    post = Post.objects.filter(pk=task_obj.payload['post_id'], published_date__isnull=False) \
+        .only('id', 'author_id', 'published_date').first()
+    if post is None:
+        return
+    followers = Contact.objects.filter(user_to_id=post.author_id)
+    if task_obj.total is None:
+        task_obj.checkpoint(total=followers.count())
+
+    after_id = task_obj.payload.get('after_id', 0)
+    while True:
+        batch = list(followers.filter(id__gt=after_id).order_by('id').values_list('id', 'user_from_id')[:FANOUT_BATCH_SIZE])
+        if not batch:
+            break
+        after_id = batch[-1][0]
+        with transaction.atomic():
+            push_post(post, [user_id for _, user_id in batch])
+            task_obj.checkpoint(progress=task_obj.progress + len(batch), after_id=after_id)
+
+
+@task
+def rebuild_user_timeline(task_obj):
+    rebuild_timeline(task_obj.payload['user_id'])
+    task_obj.checkpoint(progress=1, total=1)
+
+
+@task
+def notify_new_follower(task_obj):
+    contact = Contact.objects.select_related('user_from__profile').filter(pk=task_obj.payload['contact_id']).first()
+    if contact is None:
+        return
+    follower = contact.user_from
+    Message.objects.create(sender=follower,
+        recipient_id=contact.user_to_id,
+        subject="🌟 你增加了一个新粉丝",
+        body=f"用户 {follower.profile.nickname or follower.username} 刚刚关注了你！")
+    task_obj.checkpoint(progress=1, total=1)
+
+
+@task
+def process_avatar(task_obj):
+    profile = Profile.objects.filter(pk=task_obj.payload['profile_id']).first()
+    if profile is None:
+        return
+    # 哈希经过 save() 写入，页面缓存由 post_save 清掉
+    refresh_variants(profile)
+    task_obj.checkpoint(progress=1, total=1)
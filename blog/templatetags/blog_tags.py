@@ -1,13 +1,23 @@
-import markdown
 from django import template
 from django.utils.safestring import mark_safe
+from blog.models import Post
+from blog.rendering import render_markdown
 
 register = template.Library()
 
+
 @register.filter(name='markdown')
-def markdown_format(text):
-    return mark_safe(markdown.markdown(text, extensions=[
-        'markdown.extensions.extra',
-        'markdown.extensions.codehilite',
-        'markdown.extensions.toc',
-    ]))
\ No newline at end of file
+def markdown_format(value):
+    if isinstance(value, Post):
+        return mark_safe(value.rendered_html())
+    return mark_safe(render_markdown(value))
+
+
+@register.filter
+def avatar_url(profile, size=64):
+    return profile.avatar_url(int(size))
+
+
+@register.filter
+def avatar_fallback_url(profile, size=64):
+    return profile.avatar_url(int(size), 'jpg')
@@ -1,3 +1,1152 @@
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache, caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections, router, transaction
+from django.db.utils import ConnectionHandler
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image, ImageFile
+
+from my_blog_project.settings import env, tune_database
+
+from .management.commands.check_query_plans import query_plans
+from .avatars import refresh_variants, variants_exist
+from .comments import COMMENT_PAGE_SIZE, load_comment_page, load_replies
+from .chunked import MAX_OPEN_UPLOADS, UPLOAD_EXPIRY, UploadError, claim_chunk, part_path, start_upload, write_chunk
+from .images import optimize_image
+from .models import (
+    Attachment, AttachmentVariant, Broadcast, BroadcastWatermark, Comment, Contact, Message, Post, Profile, Task,
+    UploadSession, toggle_like,
+)
+from .notifications import aget_unread_counts, get_unread_counts, unread_cache_key
+from .pagecache import page_cache_stats, tag_versions
+from .rendering import EXCERPT_WORDS, content_hash, leading_blocks
+from .routers import PIN_COOKIE, ReadYourWritesMiddleware, pinned_to_primary, reset_pinning, wrote_to_primary
+from .search import BACKENDS, document_for, get_backend, search_posts, search_window
+from .storage import attachment_storage, lock_blob
+from .tasks import LOCK_TIMEOUT, claim_next_task, enqueue, run_pending
+from .timeline import TIMELINE_PAGE_SIZE, timeline_page
+from .views import POSTS_PER_PAGE
+
+class MediaTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(
+            MEDIA_ROOT=self.media_root, MEDIA_SERVE_MODE='django',
+            CHUNKED_UPLOAD_DIR=os.path.join(self.media_root, 'chunks'),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def write_media(self, name, content):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return '/media/' + name
+
+
+class ServeMediaTests(MediaTestCase):
+    def test_markup_is_downloaded_not_rendered(self):
+        url = self.write_media('attachments/blobs/ab/cd/page.html', b'<script>alert(1)</script>')
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        self.assertTrue(response['Content-Disposition'].startswith('attachment'))
+        self.assertEqual(response['Content-Security-Policy'], 'sandbox')
+
+    def test_download_uses_the_uploaded_name(self):
+        Attachment.objects.create(file='attachments/blobs/ab/cd/abcd.pdf', name='季度报告.pdf', size=4)
+        url = self.write_media('attachments/blobs/ab/cd/abcd.pdf', b'%PDF')
+        response = self.client.get(url)
+        self.assertIn("filename*=utf-8''%E5%AD%A3%E5%BA%A6%E6%8A%A5%E5%91%8A.pdf", response['Content-Disposition'])
+
+    def test_images_are_inline(self):
+        url = self.write_media('attachments/blobs/ab/cd/photo.png', b'\x89PNG\r\n\x1a\n')
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertFalse(response.get('Content-Disposition', '').startswith('attachment'))
+        self.assertEqual(response['Content-Security-Policy'], 'sandbox')
+
+    def test_range_responses_keep_safety_headers(self):
+        url = self.write_media('attachments/notes.txt', b'0123456789')
+        response = self.client.get(url, HTTP_RANGE='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'234')
+        self.assertTrue(response['Content-Disposition'].startswith('attachment'))
+
+
+class UnsafeUploadTests(MediaTestCase):
+    def test_markup_uploads_are_rejected(self):
+        user = User.objects.create_user('writer', password='pw')
+        self.client.force_login(user)
+        for name in ('x.html', 'x.SVG'):
+            upload = SimpleUploadedFile(name, b'<script>alert(1)</script>')
+            response = self.client.post('/api/image/upload/', {'image': upload})
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Attachment.objects.exists())
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        user = User.objects.create_user('writer')
+        post = Post.objects.create(author=user, title='t', text='x', published_date=timezone.now())
+        for label, plan, tables in query_plans(user.pk, post.pk):
+            with self.subTest(label):
+                self.assertEqual(tables, [], plan)
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    def tune(self, url, **environ):
+        with mock.patch.dict(os.environ, environ):
+            return tune_database(env.db_url_config(url))
+
+    def test_postgres_uses_pool_by_default(self):
+        database = self.tune('postgres://blog:pw@db:5432/blog')
+        self.assertEqual(database['OPTIONS'], {'pool': {'min_size': 2, 'max_size': 10, 'timeout': 10}})
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+        self.assertFalse(database['DISABLE_SERVER_SIDE_CURSORS'])
+
+    def test_pool_size_from_environment(self):
+        database = self.tune(
+            'postgres://blog:pw@db:5432/blog',
+            DATABASE_POOL_MIN_SIZE='4', DATABASE_POOL_MAX_SIZE='32', DATABASE_POOL_TIMEOUT='3',
+        )
+        self.assertEqual(database['OPTIONS']['pool'], {'min_size': 4, 'max_size': 32, 'timeout': 3})
+
+    def test_pool_can_be_disabled(self):
+        database = self.tune(
+            'postgres://blog:pw@db:5432/blog', DATABASE_POOL='off', CONN_MAX_AGE='120', DISABLE_SERVER_SIDE_CURSORS='on',
+        )
+        self.assertNotIn('pool', database.get('OPTIONS', {}))
+        self.assertEqual(database['CONN_MAX_AGE'], 120)
+        self.assertTrue(database['DISABLE_SERVER_SIDE_CURSORS'])
+
+    def test_sqlite_keeps_persistent_connections(self):
+        database = self.tune('sqlite:////tmp/blog.sqlite3')
+        self.assertEqual(database['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertEqual(database['CONN_MAX_AGE'], 60)
+        self.assertNotIn('pool', database['OPTIONS'])
+
+
+class SQLiteTuningTests(SimpleTestCase):
+    # 测试只连自己的临时库，放行同名别名以免被当成访问测试数据库
+    databases = {DEFAULT_DB_ALIAS}
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with mock.patch('my_blog_project.settings.SQLITE_PRODUCTION', True):
+            database = tune_database(env.db_url_config(f'sqlite:///{directory}/blog.sqlite3'))
+        # 单独的连接处理器，连接不在全局 connections 里
+        self.handler = ConnectionHandler({DEFAULT_DB_ALIAS: database})
+        self.connection = self.handler[DEFAULT_DB_ALIAS]
+        self.addCleanup(self.connection.close)
+
+    def pragma(self, name):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_are_applied_on_connect(self):
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('temp_store'), 2)
+
+    def test_transactions_take_the_write_lock_up_front(self):
+        with mock.patch('django.db.transaction.connections', self.handler), \
+                CaptureQueriesContext(self.connection) as queries:
+            with transaction.atomic():
+                self.pragma('user_version')
+        self.assertEqual(queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+
+class ClaimTaskTests(TestCase):
+    def test_each_task_is_claimed_once(self):
+        first = Task.objects.create(name='process_avatar')
+        second = Task.objects.create(name='process_avatar')
+        claimed = [claim_next_task(), claim_next_task()]
+        self.assertEqual([task.pk for task in claimed], [first.pk, second.pk])
+        self.assertTrue(all(task.status == 'running' and task.attempts == 1 for task in claimed))
+        self.assertIsNone(claim_next_task())
+
+    def test_stale_task_out_of_attempts_fails(self):
+        stale = Task.objects.create(
+            name='process_avatar', status='running', attempts=5, max_attempts=5,
+            locked_at=timezone.now() - LOCK_TIMEOUT * 2,
+        )
+        self.assertIsNone(claim_next_task())
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.attempts), ('failed', 5))
+        self.assertIsNone(stale.locked_at)
+
+    def test_stale_running_task_is_reclaimed(self):
+        stale = Task.objects.create(
+            name='process_avatar', status='running', attempts=1,
+            locked_at=timezone.now() - LOCK_TIMEOUT - timedelta(seconds=1),
+        )
+        Task.objects.create(name='process_avatar', status='running', attempts=1, locked_at=timezone.now())
+        task = claim_next_task()
+        self.assertEqual(task.pk, stale.pk)
+        self.assertEqual(task.attempts, 2)
+        self.assertIsNone(claim_next_task())
+
+
+class SkipLockedClaimTests(TransactionTestCase):
+    @skipUnlessDBFeature('has_select_for_update_skip_locked')
+    def test_task_locked_by_another_worker_is_skipped(self):
+        locked = Task.objects.create(name='process_avatar')
+        free = Task.objects.create(name='process_avatar')
+        holding, release = threading.Event(), threading.Event()
+
+        def other_worker():
+            try:
+                with transaction.atomic():
+                    Task.objects.select_for_update().get(pk=locked.pk)
+                    holding.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        worker = threading.Thread(target=other_worker)
+        worker.start()
+        try:
+            self.assertTrue(holding.wait(10))
+            self.assertEqual(claim_next_task().pk, free.pk)
+            self.assertIsNone(claim_next_task())
+        finally:
+            release.set()
+            worker.join()
+        self.assertEqual(claim_next_task().pk, locked.pk)
+
+
+class SearchBackendTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('writer')
+        now = timezone.now()
+        cls.title_hit = Post.objects.create(
+            author=author, title='数据库性能优化', text='索引和连接池', published_date=now,
+        )
+        cls.body_hit = Post.objects.create(
+            author=author, title='周末随笔', text='顺便聊了几句性能优化', published_date=now,
+        )
+        cls.other = Post.objects.create(
+            author=author, title='Django caching', text='fragment cache keys', published_date=now,
+        )
+
+    def setUp(self):
+        if connection.vendor not in BACKENDS:
+            self.skipTest(f'No full-text backend for {connection.vendor}')
+
+    def test_backend_matches_database(self):
+        self.assertIsInstance(get_backend(), BACKENDS[connection.vendor])
+
+    def test_title_matches_rank_first(self):
+        results = search_posts('性能优化', Post.objects.all())
+        self.assertEqual(results.count(), 2)
+        self.assertEqual([post.pk for post in results[:10]], [self.title_hit.pk, self.body_hit.pk])
+
+    def test_snippets_are_highlighted(self):
+        post = search_posts('caching', Post.objects.all())[0]
+        self.assertEqual(post.pk, self.other.pk)
+        self.assertIn('<mark>', search_posts('fragment', Post.objects.all())[0].search_snippet)
+
+    def test_entities_are_indexed_as_text(self):
+        title, body = document_for(Post(title='t', text_html='<p>AT&amp;T &lt;b&gt; caf&eacute;</p>'))
+        self.assertEqual(body, 'AT&T <b> café')
+
+    def test_deleted_posts_leave_the_index(self):
+        self.other.delete()
+        self.assertEqual(search_posts('caching', Post.objects.all()).count(), 0)
+
+    def test_ranked_results_page_by_keyset(self):
+        author = User.objects.get(username='writer')
+        for n in range(6):
+            Post.objects.create(
+                author=author, title=f'第 {n} 篇', text='索引 ' * (n + 1) + '其他内容' * (6 - n), published_date=timezone.now(),
+            )
+        window = dict(limit=3, published_before=timezone.now())
+        first, next_cursor, previous_cursor = search_window('索引', Post.objects.all(), **window)
+        self.assertIsNone(previous_cursor)
+        second, next_cursor, previous_cursor = search_window('索引', Post.objects.all(), after=next_cursor, **window)
+        third, next_cursor, _ = search_window('索引', Post.objects.all(), after=next_cursor, **window)
+        self.assertIsNone(next_cursor)
+
+        ranked = [post.pk for post in search_posts('索引', Post.objects.all(), published_before=timezone.now())[:10]]
+        paged = first + second + third
+        self.assertEqual(len(paged), 7)
+        self.assertEqual(sorted(post.pk for post in paged), sorted(ranked))
+        scores = [post.search_rank for post in paged]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertTrue(all(post.search_snippet for post in paged))
+
+        back, _, _ = search_window('索引', Post.objects.all(), before=previous_cursor, **window)
+        self.assertEqual([post.pk for post in back], [post.pk for post in first])
+
+    def test_search_page_is_ranked(self):
+        user = User.objects.get(username='writer')
+        self.client.force_login(user)
+        response = self.client.get('/', {'q': '性能优化'})
+        self.assertEqual([post.pk for post in response.context['posts']], [self.title_hit.pk, self.body_hit.pk])
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    # TestCase 把主库包在事务里，路由器在事务中总是读主库，这里只能用 TransactionTestCase
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # 只在这组用例里加一个 replica 别名，连到已经建好的主库测试库，用完即删。
+        # 测试运行器一开始就会检查 databases 里的每个别名，所以它不能写在类属性里
+        default = connections['default'].settings_dict
+        connections.settings['replica'] = dict(default, TEST=dict(default['TEST'], MIRROR='default'))
+        cls.databases = cls.databases | {'replica'}
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.databases = cls.databases - {'replica'}
+        super().tearDownClass()
+
+    def setUp(self):
+        self.author = User.objects.create_user('writer', password='pw')
+        self.post = Post.objects.create(author=self.author, title='t', text='x', published_date=timezone.now())
+        # 配置了 DATABASE_REPLICA_URLS 时也只读这个镜像，结果才是确定的
+        patcher = mock.patch('blog.routers.replica_aliases', return_value=['replica'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 上面的写入把测试自己的上下文钉在了主库上，每个用例从干净的状态开始
+        tokens = pinned_to_primary.set(False), wrote_to_primary.set(False)
+        self.addCleanup(reset_pinning, tokens)
+
+    def capture(self):
+        return CaptureQueriesContext(connections['default']), CaptureQueriesContext(connections['replica'])
+
+    def run_request(self, view, cookies=None, method='get'):
+        request = getattr(RequestFactory(), method)('/')
+        request.COOKIES.update(cookies or {})
+        return ReadYourWritesMiddleware(view)(request)
+
+    def test_reads_go_to_replica(self):
+        primary, replica = self.capture()
+        with primary, replica:
+            self.assertEqual(Post.objects.get(pk=self.post.pk).title, 't')
+        self.assertEqual(len(primary), 0)
+        self.assertEqual(len(replica), 1)
+
+    def test_database_cache_reads_stay_on_primary(self):
+        # 缓存条目刚写进主库，从副本读会被当成未命中
+        cache_model = DatabaseCache('blog_cache', {}).cache_model_class
+        self.assertEqual(router.db_for_read(cache_model), 'default')
+        self.assertFalse(pinned_to_primary.get())
+
+    def test_reads_after_a_write_stay_on_primary(self):
+        # GET 请求一开始没有被钉住，是写入本身把后面的读切到主库
+        def view(request):
+            Post.objects.filter(pk=self.post.pk).update(title='edited')
+            primary, replica = self.capture()
+            with primary, replica:
+                self.assertEqual(Post.objects.get(pk=self.post.pk).title, 'edited')
+            self.assertEqual((len(primary), len(replica)), (1, 0))
+            return HttpResponse()
+
+        response = self.run_request(view)
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_pin_cookie_survives_into_next_request(self):
+        self.client.force_login(self.author)
+        response = self.client.post(f'/post/{self.post.pk}/like/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        # 测试客户端会带上刚设置的 cookie
+        primary, replica = self.capture()
+        with primary, replica:
+            self.client.get('/api/notifications/unread/')
+        self.assertGreater(len(primary), 0)
+        self.assertEqual(len(replica), 0)
+
+        del self.client.cookies[PIN_COOKIE]
+        primary, replica = self.capture()
+        with primary, replica:
+            self.client.get('/api/notifications/unread/')
+        self.assertGreater(len(replica), 0)
+        self.assertFalse(any('blog_' in query['sql'] for query in primary.captured_queries))
+
+    def test_pinning_does_not_leak_between_requests(self):
+        def writer(request):
+            Post.objects.filter(pk=self.post.pk).update(title='edited')
+            return HttpResponse()
+
+        def reader(request):
+            self.assertFalse(pinned_to_primary.get())
+            primary, replica = self.capture()
+            with primary, replica:
+                Post.objects.get(pk=self.post.pk)
+            self.assertEqual((len(primary), len(replica)), (0, 1))
+            return HttpResponse()
+
+        self.assertIn(PIN_COOKIE, self.run_request(writer, method='post').cookies)
+        self.assertFalse(pinned_to_primary.get())
+        self.assertFalse(wrote_to_primary.get())
+        self.assertNotIn(PIN_COOKIE, self.run_request(reader).cookies)
+
+
+class ChunkedUploadTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('writer', password='pw')
+        self.user.user_permissions.add(Permission.objects.get(codename='add_post'))
+        self.client.force_login(self.user)
+
+    def send_chunk(self, session, offset, data):
+        return self.client.post(
+            f'/api/uploads/{session.pk}/?offset={offset}', data, content_type='application/octet-stream',
+            HTTP_X_CHUNK_SHA256=hashlib.sha256(data).hexdigest(),
+        )
+
+    def test_upload_requires_add_post(self):
+        session = start_upload(self.user, 'notes.txt', 4)
+        reader = User.objects.create_user('reader', password='pw')
+        self.client.force_login(reader)
+        self.assertEqual(self.client.post('/api/uploads/', {'filename': 'notes.txt', 'size': 4}).status_code, 403)
+        self.assertEqual(self.send_chunk(session, 0, b'data').status_code, 403)
+
+    def test_upload_completes(self):
+        response = self.client.post('/api/uploads/', {'filename': 'notes.txt', 'size': 4})
+        self.assertEqual(response.status_code, 201)
+        session = UploadSession.objects.get(pk=response.json()['upload_id'])
+        self.assertEqual(self.send_chunk(session, 0, b'da').status_code, 200)
+        self.assertEqual(self.send_chunk(session, 0, b'da').status_code, 409)
+        self.assertEqual(self.send_chunk(session, 2, b'ta').status_code, 200)
+        session.refresh_from_db()
+        self.assertIsNotNone(session.attachment_id)
+        self.assertIsNone(session.locked_at)
+        self.assertFalse(os.path.exists(part_path(session)))
+
+    def test_open_uploads_are_capped(self):
+        for _ in range(MAX_OPEN_UPLOADS):
+            start_upload(self.user, 'notes.txt', 4)
+        with self.assertRaises(UploadError) as cm:
+            start_upload(self.user, 'notes.txt', 4)
+        self.assertEqual(cm.exception.status, 429)
+
+    def test_open_upload_bytes_are_capped(self):
+        start_upload(self.user, 'big.bin', 2 * 1024 ** 3)
+        start_upload(self.user, 'big.bin', 2 * 1024 ** 3)
+        with self.assertRaises(UploadError) as cm:
+            start_upload(self.user, 'notes.txt', 4)
+        self.assertEqual(cm.exception.status, 429)
+
+    def test_abandoned_uploads_expire(self):
+        sessions = [start_upload(self.user, 'notes.txt', 4) for _ in range(MAX_OPEN_UPLOADS)]
+        UploadSession.objects.update(updated_at=timezone.now() - UPLOAD_EXPIRY - timedelta(minutes=1))
+        self.assertEqual(self.send_chunk(sessions[0], 0, b'da').status_code, 410)
+        # 过期的上传不再占配额，开始新的上传时被清理掉
+        start_upload(self.user, 'notes.txt', 4)
+        self.assertEqual(UploadSession.objects.count(), 1)
+        self.assertFalse(any(os.path.exists(part_path(session)) for session in sessions))
+
+    def test_concurrent_chunk_at_same_offset_is_rejected(self):
+        session = start_upload(self.user, 'notes.txt', 4)
+        self.assertIsNotNone(claim_chunk(session, 0))
+        self.assertIsNone(claim_chunk(session, 0))
+        with open(part_path(session), 'wb') as part:
+            part.write(b'da')
+        with self.assertRaises(UploadError) as cm:
+            write_chunk(session, 0, SimpleUploadedFile('chunk', b'xx'), hashlib.sha256(b'xx').hexdigest())
+        self.assertEqual(cm.exception.status, 409)
+        # 抢占失败的请求没有动临时文件
+        with open(part_path(session), 'rb') as part:
+            self.assertEqual(part.read(), b'da')
+
+
+class OptimizeImageTests(SimpleTestCase):
+    def png(self, size):
+        buffer = BytesIO()
+        Image.new('RGB', size).save(buffer, 'PNG')
+        return SimpleUploadedFile('photo.png', buffer.getvalue())
+
+    def test_small_image_is_converted(self):
+        optimized = optimize_image(self.png((40, 30)))
+        self.assertEqual((optimized.width, optimized.height), (40, 30))
+
+    def test_oversized_image_is_not_decoded(self):
+        upload = self.png((40, 30))
+        with mock.patch('blog.images.IMAGE_MAX_PIXELS', 1000), \
+                mock.patch.object(ImageFile.ImageFile, 'load', side_effect=AssertionError('decoded')):
+            self.assertIsNone(optimize_image(upload))
+        self.assertEqual(upload.tell(), 0)
+
+    def test_decompression_bomb_is_skipped(self):
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 100):
+            self.assertIsNone(optimize_image(self.png((40, 30))))
+
+
+class AttachmentStorageTests(MediaTestCase):
+    def png(self, size=(1200, 900)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'PNG')
+        return SimpleUploadedFile('photo.png', buffer.getvalue())
+
+    def test_identical_uploads_share_a_blob(self):
+        first = Attachment.from_upload(SimpleUploadedFile('a.txt', b'same'))
+        second = Attachment.from_upload(SimpleUploadedFile('b.txt', b'same'))
+        self.assertEqual(first.file.name, second.file.name)
+        storage = attachment_storage()
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(storage.exists(second.file.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(storage.exists(second.file.name))
+
+    def test_variants_are_rows_and_leave_with_the_attachment(self):
+        attachment = Attachment.from_upload(self.png())
+        names = list(attachment.variant_files.values_list('file', flat=True))
+        self.assertEqual(len(names), 2)
+        self.assertIn(' 480w', attachment.srcset())
+        storage = attachment_storage()
+        self.assertTrue(all(storage.is_referenced(name) for name in names))
+        with self.captureOnCommitCallbacks(execute=True):
+            attachment.delete()
+        self.assertFalse(AttachmentVariant.objects.exists())
+        self.assertFalse(any(storage.exists(name) for name in names))
+
+    def test_variant_shared_with_another_attachment_is_kept(self):
+        first = Attachment.from_upload(self.png())
+        second = Attachment.from_upload(self.png())
+        names = list(second.variant_files.values_list('file', flat=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(all(attachment_storage().exists(name) for name in names))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'SQLite 的写事务本来就是串行的')
+class BlobLockTests(TransactionTestCase):
+    def test_delete_waits_for_a_new_reference(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        storage = attachment_storage()
+        with override_settings(MEDIA_ROOT=media_root):
+            name = storage.save(None, SimpleUploadedFile('a.txt', b'blob'))
+            locked, release = threading.Event(), threading.Event()
+
+            def uploader():
+                # 另一个请求已经确认 blob 存在，正要插入引用它的行
+                try:
+                    with transaction.atomic():
+                        lock_blob(name)
+                        locked.set()
+                        release.wait(10)
+                        Attachment.objects.create(file=name, name='a.txt')
+                finally:
+                    connection.close()
+
+            worker = threading.Thread(target=uploader)
+            worker.start()
+            self.assertTrue(locked.wait(10))
+            threading.Timer(0.2, release.set).start()
+            storage.delete(name)
+            worker.join()
+            self.assertTrue(storage.exists(name))
+
+
+class LikeCountTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('writer')
+        self.fan = User.objects.create_user('fan')
+        self.posts = [
+            Post.objects.create(author=self.author, title=f'p{n}', text='x', published_date=timezone.now())
+            for n in range(2)
+        ]
+        self.comment = Comment.objects.create(post=self.posts[0], author=self.author, text='c')
+
+    def like_counts(self):
+        return [Post.objects.get(pk=post.pk).like_count for post in self.posts]
+
+    def test_reverse_clear_recounts(self):
+        self.fan.blog_posts.add(*self.posts)
+        self.fan.comment_likes.add(self.comment)
+        self.assertEqual(self.like_counts(), [1, 1])
+        self.fan.blog_posts.clear()
+        self.fan.comment_likes.clear()
+        self.assertEqual(self.like_counts(), [0, 0])
+        self.assertEqual(Comment.objects.get(pk=self.comment.pk).like_count, 0)
+
+    def test_deleting_a_user_does_not_go_below_zero(self):
+        self.fan.blog_posts.add(*self.posts)
+        # 计数已经和关联表不一致的文章
+        Post.objects.filter(pk=self.posts[0].pk).update(like_count=0)
+        self.fan.delete()
+        self.assertEqual(self.like_counts(), [0, 0])
+
+
+class UnreadCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('writer')
+        self.fans = [User.objects.create_user(f'fan{n}') for n in range(2)]
+        for fan in self.fans:
+            Contact.objects.create(user_from=fan, user_to=self.author)
+
+    def broadcast(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Broadcast.objects.create(sender=self.author, subject='s', body='b')
+
+    def test_new_broadcast_recounts_only_broadcasts(self):
+        self.assertEqual(get_unread_counts(self.fans[0].pk), {'comments': 0, 'messages': 0, 'broadcasts': 0})
+        with self.assertNumQueries(0):
+            get_unread_counts(self.fans[0].pk)
+
+        self.broadcast()
+        # 别的用户的缓存不会因为广播被清掉
+        self.assertIsNotNone(cache.get(unread_cache_key(self.fans[0].pk)))
+        with self.assertNumQueries(2):
+            self.assertEqual(get_unread_counts(self.fans[0].pk)['broadcasts'], 1)
+        with self.assertNumQueries(0):
+            get_unread_counts(self.fans[0].pk)
+
+    def test_new_comment_and_message_refresh_the_recipient(self):
+        post = Post.objects.create(author=self.author, title='t', text='x', published_date=timezone.now())
+        self.assertEqual(get_unread_counts(self.author.pk), {'comments': 0, 'messages': 0, 'broadcasts': 0})
+        Comment.objects.create(post=post, author=self.fans[0], text='c')
+        Message.objects.create(sender=self.fans[0], recipient=self.author, subject='s', body='b')
+        self.assertEqual(get_unread_counts(self.author.pk), {'comments': 1, 'messages': 1, 'broadcasts': 0})
+
+    def test_opening_the_inbox_marks_comments_read(self):
+        post = Post.objects.create(author=self.author, title='t', text='x', published_date=timezone.now())
+        Comment.objects.create(post=post, author=self.fans[0], text='c')
+        self.assertEqual(get_unread_counts(self.author.pk)['comments'], 1)
+        self.client.force_login(self.author)
+        self.client.get('/message/inbox/')
+        self.assertEqual(get_unread_counts(self.author.pk)['comments'], 0)
+
+    def test_caught_up_watermark_skips_the_count(self):
+        get_unread_counts(self.fans[0].pk)
+        broadcast = self.broadcast()
+        BroadcastWatermark.advance(self.fans[0].pk, broadcast.pk)
+        # 只查已读水位，不再数广播
+        with self.assertNumQueries(1):
+            self.assertEqual(get_unread_counts(self.fans[0].pk)['broadcasts'], 0)
+
+    def test_async_counts_match(self):
+        self.broadcast()
+        expected = get_unread_counts(self.fans[1].pk)
+        cache.clear()
+        self.assertEqual(async_to_sync(aget_unread_counts)(self.fans[1].pk), expected)
+        self.assertEqual(expected['broadcasts'], 1)
+
+
+class AvatarVariantTests(MediaTestCase):
+    def upload_avatar(self, profile, color):
+        buffer = BytesIO()
+        Image.new('RGB', (300, 300), color).save(buffer, 'PNG')
+        profile.avatar = SimpleUploadedFile(f'{color}.png', buffer.getvalue())
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.save()
+        refresh_variants(profile)
+        return profile.avatar_hash
+
+    def test_replaced_avatar_variants_are_deleted(self):
+        profile = User.objects.create_user('writer').profile
+        old = self.upload_avatar(profile, 'red')
+        self.assertTrue(variants_exist(old))
+        new = self.upload_avatar(profile, 'blue')
+        self.assertTrue(variants_exist(new))
+        self.assertFalse(any(
+            os.path.exists(os.path.join(self.media_root, 'avatars', 'variants', old[:2], old, name))
+            for name in ('32.webp', '64.jpg', '200.webp')
+        ))
+
+    def test_new_hash_touches_the_author_posts(self):
+        profile = User.objects.create_user('writer').profile
+        post = Post.objects.create(author=profile.user, title='t', text='x')
+        earlier = timezone.now() - timedelta(days=1)
+        Post.objects.filter(pk=post.pk).update(updated_at=earlier)
+        digest = self.upload_avatar(profile, 'red')
+        self.assertEqual(Profile.objects.get(pk=profile.pk).avatar_hash, digest)
+        self.assertGreater(Post.objects.get(pk=post.pk).updated_at, earlier)
+
+    def test_variants_shared_with_another_profile_are_kept(self):
+        first = User.objects.create_user('first').profile
+        second = User.objects.create_user('second').profile
+        shared = self.upload_avatar(first, 'red')
+        self.assertEqual(self.upload_avatar(second, 'red'), shared)
+        self.upload_avatar(first, 'blue')
+        self.assertTrue(variants_exist(shared))
+
+
+class ProfileDirtyFieldsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer')
+
+    def test_assigned_deferred_field_is_saved(self):
+        profile = Profile.objects.only('id', 'user').get(user=self.user)
+        profile.nickname = 'changed'
+        self.assertEqual(profile.changed_fields(), ['nickname'])
+        profile.save()
+        self.assertEqual(Profile.objects.get(user=self.user).nickname, 'changed')
+
+    def test_unrelated_change_leaves_posts_alone(self):
+        post = Post.objects.create(author=self.user, title='t', text='x')
+        earlier = timezone.now() - timedelta(days=1)
+        Post.objects.filter(pk=post.pk).update(updated_at=earlier)
+        profile = Profile.objects.get(user=self.user)
+        profile.bio = '新的简介'
+        profile.save()
+        self.assertEqual(Post.objects.get(pk=post.pk).updated_at, earlier)
+        profile.nickname = '新昵称'
+        profile.save()
+        self.assertGreater(Post.objects.get(pk=post.pk).updated_at, earlier)
+
+    def test_lazily_loaded_field_is_not_dirty(self):
+        profile = Profile.objects.only('id', 'user').get(user=self.user)
+        self.assertEqual(profile.nickname, 'writer')
+        self.assertEqual(profile.changed_fields(), [])
+        with self.assertNumQueries(0):
+            profile.save()
+
+
+class ConditionalPageTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('writer')
+        now = timezone.now()
+        self.older = Post.objects.create(author=self.author, title='old', text='x', published_date=now - timedelta(days=1))
+        self.post = Post.objects.create(author=self.author, title='t', text='x', published_date=now)
+
+    def test_not_modified_list_takes_two_lookups(self):
+        etag = self.client.get('/')['ETag']
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_post_list_etag_follows_author_avatar(self):
+        etag = self.client.get('/')['ETag']
+        profile = Profile.objects.get(user=self.author)
+        profile.avatar_hash = '0' * 64
+        profile.save(update_fields=['avatar_hash'])
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_post_list_etag_follows_deletions(self):
+        etag = self.client.get('/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.older.delete()
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail_reuses_the_validated_comment_count(self):
+        Comment.objects.create(post=self.post, author=self.author, text='c')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/post/{self.post.pk}/')
+        self.assertEqual(response.context['comment_count'], 1)
+        self.assertFalse(any('"__count"' in query['sql'] for query in queries.captured_queries))
+
+
+class PostRenderingTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('writer')
+
+    def test_markdown_is_rendered_on_save(self):
+        post = Post.objects.create(author=self.author, title='t', text='# 标题\n\n**粗体**')
+        self.assertIn('<strong>粗体</strong>', post.text_html)
+        self.assertEqual(post.text_html_hash, content_hash(post.text))
+        post.text = '*斜体*'
+        post.save(update_fields=['text'])
+        post.refresh_from_db()
+        self.assertIn('<em>斜体</em>', post.text_html)
+        self.assertEqual(post.text_html_hash, content_hash('*斜体*'))
+
+    def test_unchanged_text_is_not_rerendered(self):
+        post = Post.objects.create(author=self.author, title='t', text='x')
+        with mock.patch('blog.models.render_markdown') as render:
+            post.title = 'renamed'
+            post.save()
+        render.assert_not_called()
+
+    def test_stale_html_is_rendered_without_writing(self):
+        post = Post.objects.create(author=self.author, title='t', text='**新**')
+        Post.objects.filter(pk=post.pk).update(text_html='<p>旧</p>', text_html_hash='stale')
+        post.refresh_from_db()
+        with self.assertNumQueries(0):
+            html = post.rendered_html()
+        self.assertIn('<strong>新</strong>', html)
+        self.assertEqual(Post.objects.get(pk=post.pk).text_html, '<p>旧</p>')
+
+
+class RerenderPostsTests(TestCase):
+    def test_rewritten_posts_bump_updated_at_and_pages(self):
+        author = User.objects.create_user('writer')
+        post = Post.objects.create(author=author, title='t', text='**新**', published_date=timezone.now())
+        earlier = timezone.now() - timedelta(days=1)
+        Post.objects.filter(pk=post.pk).update(text_html='<p>旧</p>', text_html_hash='stale', updated_at=earlier)
+        versions = tag_versions([f'post:{post.pk}'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rerender_posts', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertIn('<strong>新</strong>', post.text_html)
+        self.assertEqual(post.text_html_hash, content_hash(post.text))
+        self.assertGreater(post.updated_at, earlier)
+        self.assertNotEqual(tag_versions([f'post:{post.pk}']), versions)
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        caches['template_fragments'].clear()
+        self.author = User.objects.create_user('writer')
+        self.reader = User.objects.create_user('reader')
+        self.post = Post.objects.create(author=self.author, title='t', text='正文', published_date=timezone.now())
+        self.comment = Comment.objects.create(post=self.post, author=self.author, text='评论')
+        self.url = f'/post/{self.post.pk}/'
+
+    def test_comment_controls_follow_the_viewer(self):
+        remove_url = f'/comment/{self.comment.pk}/remove/'
+        self.client.force_login(self.reader)
+        self.assertNotContains(self.client.get(self.url), remove_url)
+        # 读者先把评论片段写进了缓存，作者仍然看到自己的按钮和可以提交的 token
+        self.client.force_login(self.author)
+        response = self.client.get(self.url)
+        self.assertContains(response, remove_url)
+        self.assertContains(response, f'action="/comment/{self.comment.pk}/edit/"')
+        self.assertNotContains(response, 'name="csrfmiddlewaretoken" value=""')
+
+    def test_tag_controls_are_not_shared_with_readers(self):
+        self.post.tags.create(name='django')
+        staff = User.objects.create_user('staff', is_staff=True)
+        self.client.force_login(staff)
+        self.assertContains(self.client.get(self.url), '/delete/')
+        self.client.force_login(self.reader)
+        self.assertNotContains(self.client.get(self.url), '/delete/')
+
+    def test_rerendered_body_replaces_the_fragment(self):
+        self.client.get(self.url)
+        with mock.patch('blog.models.render_markdown', return_value='<p>带尺寸的图片</p>'):
+            self.post.render_text(force=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.save(update_fields=Post.RENDERED_FIELDS)
+        self.assertContains(self.client.get(self.url), '带尺寸的图片')
+
+    def test_edited_comment_replaces_the_fragment(self):
+        self.client.get(self.url)
+        self.comment.text = '改过的评论'
+        self.comment.save()
+        self.assertContains(self.client.get(self.url), '改过的评论')
+
+
+class TimelineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user('reader')
+        self.author = User.objects.create_user('writer')
+        now = timezone.now()
+        self.posts = [
+            Post.objects.create(author=self.author, title=f'p{i}', text='x', published_date=now - timedelta(minutes=i))
+            for i in range(12)
+        ]
+        self.client.force_login(self.reader)
+
+    def follow(self, action='follow'):
+        response = self.client.post('/user/follow/', {'id': self.author.pk, 'action': action})
+        self.assertEqual(response.json(), {'status': 'ok'})
+
+    def test_follow_fills_and_pages_the_timeline(self):
+        self.follow()
+        first, cursor = timeline_page(self.reader)
+        self.assertEqual(first, self.posts[:TIMELINE_PAGE_SIZE])
+        rest, cursor = timeline_page(self.reader, cursor)
+        self.assertEqual(rest, self.posts[TIMELINE_PAGE_SIZE:])
+        self.assertIsNone(cursor)
+
+    def test_new_post_is_pushed_to_followers(self):
+        self.follow()
+        post = Post.objects.create(author=self.author, title='new', text='x', published_date=timezone.now())
+        enqueue('push_post_to_timelines', post_id=post.pk)
+        run_pending()
+        self.assertEqual(timeline_page(self.reader)[0][0], post)
+
+    def test_unfollow_clears_the_author(self):
+        self.follow()
+        self.follow('unfollow')
+        self.assertEqual(timeline_page(self.reader), ([], None))
+
+    def test_empty_timeline_is_rebuilt_once_in_the_background(self):
+        # 时间线上线之前就存在的关注关系
+        Contact.objects.create(user_from=self.reader, user_to=self.author)
+        for _ in range(2):
+            self.assertContains(self.client.get('/user/following/posts/'), '正在整理')
+        self.assertEqual(Task.objects.filter(name='rebuild_user_timeline').count(), 1)
+        run_pending()
+        self.assertContains(self.client.get('/user/following/posts/'), 'p0')
+
+
+class ExcerptTests(TestCase):
+    def setUp(self):
+        caches['pages'].clear()
+        self.author = User.objects.create_user('writer')
+
+    def test_long_post_is_cut_to_leading_words(self):
+        text = '\n\n'.join(f'段落{i} ' + 'word ' * 30 for i in range(10))
+        post = Post.objects.create(author=self.author, title='t', text=text)
+        self.assertLessEqual(len(post.excerpt_text.split()), EXCERPT_WORDS + 1)
+        self.assertTrue(post.excerpt_text.startswith('段落0 word'))
+        self.assertNotIn('段落3', post.excerpt_html)
+        self.assertNotIn('<', post.excerpt_text)
+
+    def test_code_fence_is_not_split(self):
+        code = '\n'.join(f'line{i} = {i}' for i in range(5))
+        self.assertEqual(leading_blocks(f'开头\n\n```\n{code}\n\n{code}\n```\n\n结尾', max_words=3),
+                         f'开头\n\n```\n{code}\n\n{code}\n```')
+
+    def test_excerpt_follows_edits(self):
+        post = Post.objects.create(author=self.author, title='t', text='旧的摘要')
+        post.text = '**新的摘要**'
+        post.save(update_fields=['text'])
+        post = Post.objects.get(pk=post.pk)
+        self.assertEqual(post.excerpt_text, '新的摘要')
+        self.assertIn('<strong>新的摘要</strong>', post.excerpt_html)
+
+    def test_post_list_shows_the_stored_excerpt(self):
+        post = Post.objects.create(author=self.author, title='t', text='正文', published_date=timezone.now())
+        Post.objects.filter(pk=post.pk).update(excerpt_html='<p>存储的摘要</p>')
+        self.assertContains(self.client.get('/'), '存储的摘要')
+
+
+class CommentTreeQueryTests(TestCase):
+    def setUp(self):
+        caches['template_fragments'].clear()
+        self.author = User.objects.create_user('writer')
+        self.post = Post.objects.create(author=self.author, title='t', text='x', published_date=timezone.now())
+
+    def add_thread(self, replies=3):
+        root = Comment.objects.create(post=self.post, author=self.author, text='c')
+        parent = root
+        for _ in range(replies):
+            parent = Comment.objects.create(post=self.post, author=User.objects.create_user(f'u{Comment.objects.count()}'),
+                                            text='r', parent=parent)
+        return root
+
+    def test_comment_page_and_replies_take_one_query_each(self):
+        roots = [self.add_thread() for _ in range(5)]
+        with self.assertNumQueries(1):
+            page, _ = load_comment_page(self.post)
+        self.assertEqual([root.reply_count for root in page], [3] * 5)
+        with self.assertNumQueries(1):
+            replies = load_replies(roots[0])
+        self.assertEqual([reply.parent.author for reply in replies][1:], [reply.author for reply in replies][:-1])
+
+    def test_post_detail_queries_do_not_grow_with_comments(self):
+        self.client.force_login(self.author)
+        self.add_thread()
+        # 片段缓存未命中时还要读标签、正文和附件
+        with self.assertNumQueries(12):
+            self.client.get(f'/post/{self.post.pk}/')
+        for _ in range(5):
+            self.add_thread()
+        caches['template_fragments'].clear()
+        with self.assertNumQueries(12):
+            response = self.client.get(f'/post/{self.post.pk}/')
+        self.assertEqual(response.context['comment_count'], 24)
+        with self.assertNumQueries(8):
+            self.client.get(f'/post/{self.post.pk}/')
+
+
+class CommentEndpointTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('writer')
+        self.post = Post.objects.create(author=self.author, title='t', text='x', published_date=timezone.now())
+
+    def test_top_level_comments_page_by_cursor(self):
+        start = timezone.now()
+        roots = [
+            Comment.objects.create(post=self.post, author=self.author, text=f'c{i}', created_date=start + timedelta(seconds=i))
+            for i in range(COMMENT_PAGE_SIZE + 2)
+        ]
+        Comment.objects.create(post=self.post, author=self.author, text='reply', parent=roots[0])
+        first = self.client.get(f'/post/{self.post.pk}/comments/').json()
+        self.assertEqual([c['comment_id'] for c in first['comments']], [c.pk for c in roots[:COMMENT_PAGE_SIZE]])
+        self.assertIn('comment-item', first['comments'][0]['html'])
+        rest = self.client.get(f'/post/{self.post.pk}/comments/', {'cursor': first['next_cursor']}).json()
+        self.assertEqual([c['comment_id'] for c in rest['comments']], [c.pk for c in roots[COMMENT_PAGE_SIZE:]])
+        self.assertIsNone(rest['next_cursor'])
+
+    def test_replies_load_the_whole_thread_in_order(self):
+        root = Comment.objects.create(post=self.post, author=self.author, text='root')
+        first = Comment.objects.create(post=self.post, author=self.author, text='first', parent=root)
+        nested = Comment.objects.create(post=self.post, author=self.author, text='nested', parent=first)
+        second = Comment.objects.create(post=self.post, author=self.author, text='second', parent=root)
+        data = self.client.get(f'/comment/{root.pk}/replies/').json()
+        self.assertEqual([c['comment_id'] for c in data['comments']], [first.pk, nested.pk, second.pk])
+        self.assertEqual(data['comments'][1]['parent_id'], first.pk)
+        # 只有顶层评论才有回复线程
+        self.assertEqual(self.client.get(f'/comment/{first.pk}/replies/').status_code, 404)
+
+    def test_ajax_comment_returns_json(self):
+        self.author.user_permissions.add(Permission.objects.get(codename='add_comment'))
+        self.client.force_login(self.author)
+        response = self.client.post(f'/post/{self.post.pk}/', {'text': '你好'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json()['text'], '你好')
+        self.assertIsNone(Comment.objects.get().root_id)
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        caches['pages'].clear()
+        self.author = User.objects.create_user('writer')
+        self.post = Post.objects.create(author=self.author, title='原标题', text='x', published_date=timezone.now())
+        self.url = f'/post/{self.post.pk}/'
+
+    def assert_cached(self, url, hit):
+        before = page_cache_stats()['hit']
+        response = self.client.get(url)
+        self.assertEqual(page_cache_stats()['hit'] - before, int(hit))
+        return response
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        for url in ('/', self.url):
+            self.assert_cached(url, hit=False)
+            self.assert_cached(url, hit=True)
+        self.client.force_login(self.author)
+        self.assertEqual(page_cache_stats()['bypass'], 0)
+        self.assert_cached('/', hit=False)
+        self.assertEqual(page_cache_stats()['bypass'], 1)
+
+    def test_edit_invalidates_list_and_detail(self):
+        for url in ('/', self.url):
+            self.assert_cached(url, hit=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.title = '新标题'
+            self.post.save()
+        for url in ('/', self.url):
+            self.assertContains(self.assert_cached(url, hit=False), '新标题')
+
+    def test_comment_invalidates_detail(self):
+        self.assert_cached(self.url, hit=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=self.post, author=self.author, text='新评论')
+        self.assertContains(self.assert_cached(self.url, hit=False), '新评论')
+
+    def test_like_invalidates_detail(self):
+        self.assert_cached(self.url, hit=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            toggle_like(self.post, User.objects.create_user('fan'))
+        self.assertContains(self.assert_cached(self.url, hit=False), '<span id="post-like-count">1</span>')
+
+    def test_delete_invalidates_list(self):
+        self.assert_cached('/', hit=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.delete()
+        self.assertNotContains(self.assert_cached('/', hit=False), '原标题')
+
+
+class PostListKeysetTests(TestCase):
+    def setUp(self):
+        caches['pages'].clear()
+        author = User.objects.create_user('writer')
+        now = timezone.now()
+        # 两篇同一时刻发布的文章正好落在第一页的边界上，靠 id 区分先后
+        dates = [now - timedelta(minutes=i) for i in range(11)] + [now - timedelta(minutes=POSTS_PER_PAGE - 1)]
+        self.posts = sorted(
+            (Post.objects.create(author=author, title=f'p{i}', text='x', published_date=date) for i, date in enumerate(dates)),
+            key=lambda post: (post.published_date, post.pk), reverse=True,
+        )
+
+    def page(self, **params):
+        context = self.client.get('/', params).context
+        return list(context['posts']), context['next_cursor'], context['previous_cursor']
+
+    def test_cursors_walk_the_list_both_ways(self):
+        first, after, before = self.page()
+        self.assertEqual(first, self.posts[:POSTS_PER_PAGE])
+        self.assertIsNone(before)
+        second, after, before = self.page(after=after)
+        self.assertEqual(second, self.posts[POSTS_PER_PAGE:2 * POSTS_PER_PAGE])
+        last, end, _ = self.page(after=after)
+        self.assertEqual(last, self.posts[2 * POSTS_PER_PAGE:])
+        self.assertIsNone(end)
+        self.assertEqual(self.page(before=before)[0], first)
+
+    def test_bad_cursor_falls_back_to_the_first_page(self):
+        self.assertEqual(self.page(after='not-a-cursor')[0], self.posts[:POSTS_PER_PAGE])
+
+
+class AsyncViewTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.author = User.objects.create_user('writer')
+        self.fan = User.objects.create_user('fan')
+        self.post = Post.objects.create(author=self.author, title='p', text='x', published_date=timezone.now())
+        self.comment = Comment.objects.create(post=self.post, author=self.author, text='c')
+        self.async_client.force_login(self.fan)
+
+    async def test_likes_toggle_and_return_the_count(self):
+        for url in (f'/post/{self.post.pk}/like/', f'/comment/{self.comment.pk}/like/'):
+            response = await self.async_client.post(url)
+            self.assertEqual(response.json(), {'liked': True, 'count': 1})
+            response = await self.async_client.post(url)
+            self.assertEqual(response.json(), {'liked': False, 'count': 0})
+        self.assertEqual((await self.async_client.post('/post/0/like/')).status_code, 404)
+
+    async def test_anonymous_requests_are_turned_away(self):
+        await self.async_client.alogout()
+        response = await self.async_client.post(f'/post/{self.post.pk}/like/')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual((await self.async_client.get('/api/notifications/unread/')).status_code, 401)
+
+    async def test_follow_notifies_once(self):
+        for _ in range(2):
+            response = await self.async_client.post('/user/follow/', {'id': self.author.pk, 'action': 'follow'})
+            self.assertEqual(response.json(), {'status': 'ok'})
+        self.assertEqual(await Task.objects.filter(name='notify_new_follower').acount(), 1)
+        response = await self.async_client.post('/user/follow/', {'id': 0, 'action': 'follow'})
+        self.assertEqual(response.json(), {'status': 'error'})
+        self.assertEqual((await self.async_client.get('/user/follow/')).status_code, 405)
+
+    def test_attachment_delete_is_owner_only(self):
+        attachment = Attachment.from_upload(SimpleUploadedFile('a.txt', b'data'))
+        attachment.post = self.post
+        attachment.save()
+        response = async_to_sync(self.async_client.post)(f'/attachment/{attachment.pk}/delete/')
+        self.assertEqual(response.status_code, 403)
+        self.async_client.force_login(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = async_to_sync(self.async_client.post)(f'/attachment/{attachment.pk}/delete/')
+        self.assertEqual(response.json(), {'status': 'ok'})
+        self.assertFalse(Attachment.objects.exists())
+
+    async def test_image_upload_returns_the_stored_file(self):
+        buffer = BytesIO()
+        Image.new('RGB', (40, 30), 'red').save(buffer, 'PNG')
+        upload = SimpleUploadedFile('photo.png', buffer.getvalue())
+        response = await self.async_client.post('/api/image/upload/', {'image': upload})
+        payload = response.json()
+        self.assertTrue(payload['success'])
+        self.assertEqual((payload['width'], payload['height']), (40, 30))
+        attachment = await Attachment.objects.aget()
+        self.assertEqual(payload['url'], attachment.file.url)
+        self.assertEqual((await self.async_client.post('/api/image/upload/')).status_code, 400)
+
+    async def test_unread_counts_endpoint(self):
+        await Comment.objects.acreate(post=self.post, author=self.fan, text='hi')
+        await self.async_client.aforce_login(self.author)
+        response = await self.async_client.get('/api/notifications/unread/')
+        self.assertEqual(response.json(), {'comments': 1, 'messages': 0, 'broadcasts': 0, 'total': 1})
+        self.assertIn('no-cache', response['Cache-Control'])
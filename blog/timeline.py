@@ -0,0 +1,66 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from .models import Contact, Post, TimelineEntry
+from .pagination import keyset_page
+
+TIMELINE_LENGTH = 800
+TIMELINE_PAGE_SIZE = 10
+TIMELINE_REBUILD_INTERVAL = 60 * 60
+
+def recent_posts(author_ids):
+    return Post.objects.filter(author_id__in=author_ids, published_date__isnull=False) \
+        .order_by('-published_date', '-id').values_list('id', 'published_date')[:TIMELINE_LENGTH]
+
+def _insert(user_id, rows):
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post_id, published_date=published_date) for post_id, published_date in rows],
+        ignore_conflicts=True,
+    )
+
+def trim_timelines(user_ids):
+    overflowing = TimelineEntry.objects.filter(user_id__in=user_ids).values('user_id') \
+        .annotate(total=Count('id')).filter(total__gt=TIMELINE_LENGTH).values_list('user_id', flat=True)
+    overflowing = list(overflowing)
+    if not overflowing:
+        return
+    stale = TimelineEntry.objects.filter(user_id__in=overflowing).annotate(position=Window(
+        RowNumber(), partition_by=F('user_id'), order_by=[F('published_date').desc(), F('post_id').desc()]
+    )).filter(position__gt=TIMELINE_LENGTH).values_list('id', flat=True)
+    TimelineEntry.objects.filter(id__in=list(stale)).delete()
+
+def push_post(post, user_ids):
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post.pk, published_date=post.published_date) for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+    trim_timelines(user_ids)
+
+def follow_author(user_id, author_id):
+    _insert(user_id, recent_posts([author_id]))
+    trim_timelines([user_id])
+
+def unfollow_author(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id, post__author_id=author_id).delete()
+
+def rebuild_timeline(user_id):
+    following = Contact.objects.filter(user_from_id=user_id).values('user_to')
+    with transaction.atomic():
+        TimelineEntry.objects.filter(user_id=user_id).delete()
+        _insert(user_id, recent_posts(following))
+
+def request_rebuild(user_id):
+    """关注了人但时间线是空的（时间线上线之前的关注关系），交给后台重建；一段时间内只排队一次。"""
+    from .tasks import enqueue
+
+    if cache.add(f'blog:timeline-rebuild:{user_id}', True, TIMELINE_REBUILD_INTERVAL):
+        enqueue('rebuild_user_timeline', user_id=user_id)
+        return True
+    return False
+
+def timeline_page(user, cursor=None, limit=TIMELINE_PAGE_SIZE):
+    entries = TimelineEntry.objects.filter(user=user) \
+        .select_related('post__author__profile').defer('post__text', 'post__text_html')
+    entries, next_cursor = keyset_page(entries, 'published_date', 'post_id', cursor, limit)
+    return [entry.post for entry in entries], next_cursor
\ No newline at end of file
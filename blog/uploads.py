@@ -0,0 +1,43 @@
+import hashlib
+import os
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+# 浏览器会把这些文件当成页面或脚本来执行，附件一律拒收
+UNSAFE_UPLOAD_EXTENSIONS = {
+    '.htm', '.html', '.shtml', '.xht', '.xhtml', '.mht', '.mhtml', '.svg', '.svgz', '.xml', '.xsl', '.js', '.mjs',
+}
+
+
+def check_upload_name(name):
+    ext = os.path.splitext(name)[1].lower()
+    if ext in UNSAFE_UPLOAD_EXTENSIONS:
+        raise ValidationError(f'不允许上传 {ext} 文件')
+
+
+class HashingUploadMixin:
+    """边接收边计算 sha256，存储时不必再把文件读一遍。"""
+
+    def new_file(self, *args, **kwargs):
+        # 内存处理器接管文件时会抛出 StopFutureHandlers，哈希对象要先建好
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file_obj = super().file_complete(file_size)
+        if file_obj is not None:
+            file_obj.sha256 = self.sha256.hexdigest()
+        return file_obj
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
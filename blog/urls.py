@@ -4,18 +4,24 @@ from . import views
 urlpatterns = [
     path('', views.post_list, name='post_list'),
     path('post/<int:pk>/', views.post_detail, name='post_detail'),
+    path('post/<int:pk>/comments/', views.post_comments, name='post_comments'),
     path('post/new/', views.post_new, name='post_new'),
     path('post/<int:pk>/edit/', views.post_edit, name='post_edit'),
     path('post/<int:pk>/remove/', views.post_remove, name='post_remove'),
     path('comment/<int:pk>/edit/', views.comment_edit, name='comment_edit'),
     path('comment/<int:pk>/remove/', views.comment_remove, name='comment_remove'),
+    path('comment/<int:pk>/replies/', views.comment_replies, name='comment_replies'),
     path('post/<int:pk>/like/', views.post_like, name='post_like'),
     path('comment/<int:pk>/like/', views.comment_like, name='comment_like'),
     path('tag/<str:tag_name>/', views.post_list, name='post_list_by_tag'),
     path('tag/<int:pk>/delete/', views.tag_delete, name='tag_delete'),
+    path('api/page-cache/stats/', views.page_cache_status, name='page_cache_status'),
+    path('api/notifications/unread/', views.api_unread_counts, name='api_unread_counts'),
     path('profile/edit/', views.profile_edit, name='profile_edit'),
     path('attachment/<int:pk>/delete/', views.attachment_delete, name='attachment_delete'),
     path('api/image/upload/', views.api_image_upload, name='api_image_upload'),
+    path('api/uploads/', views.api_upload_start, name='api_upload_start'),
+    path('api/uploads/<uuid:upload_id>/', views.api_upload_chunk, name='api_upload_chunk'),
     path('message/inbox/', views.inbox, name='inbox'),
     path('message/view/<int:pk>', views.message_detail, name='message_detail'),
     path('message/send/<int:recipient_id>', views.send_message, name='send_message'),
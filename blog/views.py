@@ -1,7 +1,16 @@
-from django.shortcuts import render, get_object_or_404
+from django.shortcuts import render, get_object_or_404, aget_object_or_404
 from django.utils import timezone
-from .models import Post, Tag, Profile, Attachment, Message, Contact
+from .models import Post, Tag, Profile, Attachment, UploadSession, Message, Contact, Broadcast, BroadcastWatermark, toggle_like
 from .forms import CommentForm, SignupForm, PostForm, Comment, ProfileForm
+from .search import search_posts, search_window, filter_posts
+from .pagination import keyset_window, cached_count
+from .chunked import CHUNK_SIZE, UploadError, start_upload, write_chunk, attach_uploads
+from .pagecache import cache_anonymous_page, add_cache_tags, page_cache_stats
+from .conditional import conditional_page, post_list_validators, post_detail_validators, validated_comment_count
+from .comments import load_comment_page, load_replies, comment_payload
+from .notifications import invalidate_unread_counts, aget_unread_counts
+from .tasks import enqueue
+from .timeline import timeline_page, request_rebuild, follow_author, unfollow_author
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.core.paginator import Paginator
@@ -11,43 +20,91 @@ from django.contrib.auth.decorators import permission_required, login_required
 from django.contrib.auth.models import Group, User
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
+from django.core.exceptions import ValidationError
 from django.http import JsonResponse
 from django.db.models import Q, Count
 from django.db.models.functions import TruncDay
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
+from django.views.decorators.cache import never_cache
+from asgiref.sync import sync_to_async
 from datetime import timedelta
 from django_ratelimit.decorators import ratelimit
 import uuid
 
+BROADCAST_INBOX_LIMIT = 50
+POSTS_PER_PAGE = 5
+
+@conditional_page(post_list_validators)
+@cache_anonymous_page
 def post_list(request, tag_name = None):
+    add_cache_tags(request, 'posts')
     query = request.GET.get('q')
     tag = None
-    posts = Post.objects.filter(published_date__lte=timezone.now())
+    posts = Post.objects.filter(published_date__lte=timezone.now()).defer('text', 'text_html')
 
     if tag_name:
         tag = get_object_or_404(Tag, name = tag_name)
         posts = posts.filter(tags=tag)
+
+    # 旧的 ?page= 链接仍走 OFFSET 分页（搜索结果按相关度排序）
+    if 'page' in request.GET:
+        if query:
+            posts = search_posts(query, posts, tag=tag, published_before=timezone.now())
+        else:
+            posts = posts.order_by('-published_date')
+        paginator = Paginator(posts, POSTS_PER_PAGE)
+        page_obj = paginator.get_page(request.GET.get('page'))
+        add_cache_tags(request, *{f'user:{post.author_id}' for post in page_obj})
+        return render(request, 'blog/post_list.html', {
+            'page_obj': page_obj,
+            'posts': page_obj,
+            'total_count': paginator.count,
+            'query':query,
+            'tag': tag,
+            })
+
+    posts = posts.select_related('author__profile').prefetch_related('tags')
     if query:
-        posts = posts.filter(Q(title__icontains=query) | Q(text__icontains=query), published_date__isnull=False).distinct()
-    posts = posts.order_by('-published_date')
-    paginator = Paginator(posts, 5)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+        # 搜索结果按相关度排序，游标是 (分数, id)
+        items, next_cursor, previous_cursor = search_window(
+            query, posts, tag=tag, published_before=timezone.now(),
+            after=request.GET.get('after'), before=request.GET.get('before'), limit=POSTS_PER_PAGE,
+        )
+        posts = filter_posts(query, posts)
+    else:
+        items, next_cursor, previous_cursor = keyset_window(
+            posts, 'published_date', 'id',
+            after=request.GET.get('after'), before=request.GET.get('before'), limit=POSTS_PER_PAGE,
+        )
+    add_cache_tags(request, *{f'user:{post.author_id}' for post in items})
+    total_count = cached_count(posts, f"posts:{tag.pk if tag else ''}:{query or ''}")
     return render(request, 'blog/post_list.html', {
-        'page_obj': page_obj,
+        'posts': items,
+        'next_cursor': next_cursor,
+        'previous_cursor': previous_cursor,
+        'total_count': total_count,
         'query':query,
         'tag': tag,
         })
 
+@staff_member_required
+def page_cache_status(request):
+    return JsonResponse(page_cache_stats())
+
 @staff_member_required
 def tag_delete(request, pk):
     tag = get_object_or_404(Tag, pk=pk)
     tag.delete()
     return redirect('post_list')
 
+@conditional_page(post_detail_validators)
+@cache_anonymous_page
 def post_detail(request, pk):
-    post = get_object_or_404(Post, pk=pk)
+    add_cache_tags(request, f'post:{pk}')
+    # 正文在片段缓存里，只有缓存未命中时才去读这几个大字段
+    post = get_object_or_404(Post.objects.select_related('author__profile').defer('text', 'text_html', 'excerpt_html', 'excerpt_text'), pk=pk)
+    add_cache_tags(request, f'user:{post.author_id}')
     if request.method == "POST":
         if not request.user.has_perm('blog.add_comment'):
             from django.contrib import messages
@@ -65,21 +122,46 @@ def post_detail(request, pk):
             comment.save()
 
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({
-                    'status': 'success',
-                    'comment_id': comment.id,
-                    'author_nickname': comment.author.profile.nickname or comment.author.username,
-                    'author_username': comment.author.username,
-                    'text': comment.text,
-                    'created_date': comment.created_date.strftime('%Y-%m-%d %H:%M'),
-                    'avatar_url': comment.author.profile.avatar.url if comment.author.profile.avatar else '/static/images/default.png',
-                    'parent_id': parent_id
-                })
+                return JsonResponse(comment_payload(comment, html=False))
             return redirect(f"{reverse('post_detail', kwargs={'pk': post.pk})}#comments")
     else:
         form = CommentForm()
-    return render(request, 'blog/post_detail.html', {'post': post, 'form': form})
+    comment_tree, next_cursor = load_comment_page(post)
+    add_cache_tags(request, *{f'user:{comment.author_id}' for comment in comment_tree})
+    comment_count = validated_comment_count(request)
+    if comment_count is None:
+        comment_count = post.comments.count()
+    return render(request, 'blog/post_detail.html', {
+        'post': post,
+        'form': form,
+        'comment_tree': comment_tree,
+        'comment_count': comment_count,
+        'next_comment_cursor': next_cursor,
+        })
 
+def post_comments(request, pk):
+    post = get_object_or_404(Post, pk=pk)
+    roots, next_cursor = load_comment_page(post, request.GET.get('cursor'))
+    return JsonResponse({
+        'status': 'success',
+        'comments': [comment_payload(comment, request) for comment in roots],
+        'next_cursor': next_cursor,
+    })
+
+def comment_replies(request, pk):
+    root = get_object_or_404(Comment.objects.select_related('author__profile'), pk=pk, parent__isnull=True)
+    return JsonResponse({
+        'status': 'success',
+        'comments': [comment_payload(comment, request) for comment in load_replies(root)],
+    })
+
+
+def save_attachments(request, post):
+    for f in request.FILES.getlist('attachments'):
+        try:
+            Attachment.from_upload(f, post=post)
+        except ValidationError as e:
+            messages.error(request, e.messages[0])
 
 @permission_required('blog.add_post', raise_exception=True)
 def post_new(request):
@@ -91,22 +173,16 @@ def post_new(request):
             post.published_date = timezone.now()
             post.save()
             form.save()
-
-            followers = Contact.objects.filter(user_to=request.user).select_related('user_from')
-            notifications = [
-                Message(
-                    sender = request.user,
-                    recipient = follower.user_from,
-                    subject = '🔔 你关注的博主发布了新文章',
-                    body = f"你关注的博主 {request.user.profile.nickname or request.user.username} 发布了新文章：《{post.title}》。快去看看吧！",
-                )
-                for follower in followers
-            ]
-            Message.objects.bulk_create(notifications)
-
-            files = request.FILES.getlist('attachments')
-            for f in files:
-                Attachment.objects.create(post=post, file=f)
+            Broadcast.objects.create(
+                sender = request.user,
+                post = post,
+                subject = '🔔 你关注的博主发布了新文章',
+                body = f"你关注的博主 {request.user.profile.nickname or request.user.username} 发布了新文章：《{post.title}》。快去看看吧！",
+            )
+            enqueue('push_post_to_timelines', post_id=post.pk)
+
+            save_attachments(request, post)
+            attach_uploads(post, request.user, request.POST.getlist('upload_ids'))
             return redirect('post_detail', pk=post.pk)
     else:
         form = PostForm()
@@ -122,9 +198,8 @@ def post_edit(request, pk):
             form = PostForm(request.POST, request.FILES, instance=post)
             if form.is_valid():
                 post = form.save()
-                files = request.FILES.getlist('attachments')
-                for f in files:
-                    Attachment.objects.create(post=post, file=f)
+                save_attachments(request, post)
+                attach_uploads(post, request.user, request.POST.getlist('upload_ids'))
                 messages.success(request, "文章更新成功！")
                 return redirect('post_detail', pk=post.pk)
         else:
@@ -144,36 +219,84 @@ def post_remove(request, pk):
         return redirect('post_detail', pk=post.pk)
     
 @login_required
-def post_like(request, pk):
-    post = get_object_or_404(Post, id=pk)
-    if post.likes.filter(id=request.user.id).exists():
-        post.likes.remove(request.user)
-        liked = False
-    else:
-        post.likes.add(request.user)
-        liked = True
-    return JsonResponse({'liked': liked, 'count': post.total_likes()})
+async def post_like(request, pk):
+    post = await aget_object_or_404(Post.objects.only('id'), id=pk)
+    # 点赞要在一个事务里完成，事务只能在同步代码里用
+    liked = await sync_to_async(toggle_like)(post, await request.auser())
+    return JsonResponse({'liked': liked, 'count': post.like_count})
 
 @login_required
-def attachment_delete(request, pk):
-    attachment = get_object_or_404(Attachment, pk = pk)
-    if request.user == attachment.post.author or request.user.is_superuser:
-        attachment.delete()
+async def attachment_delete(request, pk):
+    attachment = await aget_object_or_404(Attachment.objects.select_related('post'), pk = pk)
+    user = await request.auser()
+    if (attachment.post and user.pk == attachment.post.author_id) or user.is_superuser:
+        await attachment.adelete()
         return JsonResponse({'status': 'ok'})
     return JsonResponse({'status': 'error', 'message': '没有权限'}, status=403)
 
 @csrf_exempt
 @login_required
-def api_image_upload(request):
+async def api_image_upload(request):
     if request.method == "POST" and request.FILES.get('image'):
         img = request.FILES['image']
-        instance = Attachment.objects.create(file=img)
+        # 图片压缩和写文件都是阻塞操作，放到线程里做
+        try:
+            instance = await sync_to_async(Attachment.from_upload)(img)
+        except ValidationError as e:
+            return JsonResponse({'success': False, 'message': e.messages[0]}, status=400)
         return JsonResponse({
             'success': True,
-            'url': instance.file.url
+            'url': instance.file.url,
+            'width': instance.width,
+            'height': instance.height,
         })
     return JsonResponse({'success': False}, status=400)
 
+def upload_payload(session):
+    payload = {
+        'upload_id': str(session.pk),
+        'offset': session.received,
+        'size': session.size,
+        'chunk_size': CHUNK_SIZE,
+        'complete': session.attachment_id is not None,
+    }
+    if session.attachment_id:
+        payload['attachment_id'] = session.attachment_id
+        payload['url'] = session.attachment.file.url
+    return payload
+
+@permission_required('blog.add_post', raise_exception=True)
+@require_POST
+def api_upload_start(request):
+    try:
+        size = int(request.POST.get('size', ''))
+        session = start_upload(request.user, request.POST.get('filename', ''), size, request.POST.get('sha256', ''))
+    except ValueError:
+        return JsonResponse({'success': False, 'message': '文件大小不合法'}, status=400)
+    except UploadError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=e.status)
+    return JsonResponse({'success': True, **upload_payload(session)}, status=201)
+
+@permission_required('blog.add_post', raise_exception=True)
+def api_upload_chunk(request, upload_id):
+    session = get_object_or_404(UploadSession.objects.select_related('attachment'), pk=upload_id, user=request.user)
+    if request.method == "GET":
+        return JsonResponse({'success': True, **upload_payload(session)})
+    if request.method != "POST":
+        return JsonResponse({'success': False}, status=405)
+    try:
+        offset = int(request.GET.get('offset', ''))
+        write_chunk(session, offset, request, request.headers.get('X-Chunk-SHA256'))
+    except ValueError:
+        return JsonResponse({'success': False, 'message': '分片偏移量不合法'}, status=400)
+    except UploadError as e:
+        if e.status == 410:
+            # 过期的上传已经被删除，客户端只能重新开始
+            return JsonResponse({'success': False, 'message': str(e)}, status=e.status)
+        session.refresh_from_db()
+        return JsonResponse({'success': False, 'message': str(e), **upload_payload(session)}, status=e.status)
+    return JsonResponse({'success': True, **upload_payload(session)})
+
 
 
     
@@ -210,15 +333,18 @@ def comment_edit(request, pk):
     return redirect('post_detail', pk=comment.post.pk)
 
 @login_required
-def comment_like(request, pk):
-    comment = get_object_or_404(Comment, id=pk)
-    if comment.likes.filter(id=request.user.id).exists():
-        comment.likes.remove(request.user)
-        liked = False
-    else:
-        comment.likes.add(request.user)
-        liked = True
-    return JsonResponse({'liked': liked, 'count': comment.total_likes()})
+async def comment_like(request, pk):
+    comment = await aget_object_or_404(Comment.objects.only('id', 'post_id'), id=pk)
+    liked = await sync_to_async(toggle_like)(comment, await request.auser())
+    return JsonResponse({'liked': liked, 'count': comment.like_count})
+
+@never_cache
+async def api_unread_counts(request):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'status': 'error'}, status=401)
+    counts = await aget_unread_counts(user.pk)
+    return JsonResponse({**counts, 'total': sum(counts.values())})
 
 
 
@@ -303,11 +429,14 @@ def user_list(request):
     users = User.objects.annotate(post_count=Count('post')).select_related('profile').order_by('-date_joined')
     return render(request, 'user/user_list.html', {'users': users})
 
+@cache_anonymous_page
 def profile_public(request, username):
     profile_user = get_object_or_404(User, username=username)
+    add_cache_tags(request, f'user:{profile_user.pk}')
     posts = Post.objects.filter(author=profile_user).order_by('-published_date')
     comment_count = Comment.objects.filter(author=profile_user).count()
     recent_comments = Comment.objects.filter(author=profile_user).select_related('post').order_by('-created_date')[:10]
+    add_cache_tags(request, *{f'post:{comment.post_id}' for comment in recent_comments})
     is_following = False
     if request.user.is_authenticated:
         is_following = Contact.objects.filter(user_from=request.user, user_to=profile_user).exists()
@@ -321,7 +450,8 @@ def profile_public(request, username):
             parent__author=request.user, 
             is_read=False
         ).exclude(author=request.user).select_related('post', 'author'))
-        Comment.objects.filter(parent__author=request.user, is_read=False).update(is_read=True)
+        if Comment.objects.filter(parent__author=request.user, is_read=False).update(is_read=True):
+            invalidate_unread_counts(request.user.pk)
 
     one_year_ago = timezone.now() - timedelta(days=365)
     post_activity = Post.objects.filter(author=profile_user, created_date__gte=one_year_ago) \
@@ -355,13 +485,22 @@ def profile_public(request, username):
 
 @login_required
 def inbox(request):
-    received_messages = Message.objects.filter(recipient=request.user, deleted_by_recipient=False)
+    received_messages = list(Message.objects.filter(recipient=request.user, deleted_by_recipient=False).select_related('sender__profile'))
+    broadcasts = list(Broadcast.visible_to(request.user.pk).select_related('sender__profile')[:BROADCAST_INBOX_LIMIT])
+    if broadcasts:
+        last_read_id = BroadcastWatermark.last_read(request.user.pk)
+        for broadcast in broadcasts:
+            broadcast.is_read = broadcast.id <= last_read_id
+        if BroadcastWatermark.advance(request.user.pk, broadcasts[0].id):
+            invalidate_unread_counts(request.user.pk)
+        received_messages = sorted(received_messages + broadcasts, key=lambda msg: msg.sent_at, reverse=True)
     sent_messages = Message.objects.filter(sender=request.user, deleted_by_sender=False)
     all_replies_qs = Comment.objects.filter(
         Q(post__author=request.user) | Q(parent__author=request.user)
     ).exclude(author=request.user).distinct().order_by('-created_date')
     replies_list = list(all_replies_qs)
-    all_replies_qs.filter(is_read=False).update(is_read=True)
+    if all_replies_qs.filter(is_read=False).update(is_read=True):
+        invalidate_unread_counts(request.user.pk)
     return render(request, 'user/inbox.html', {
         'received_messages' : received_messages,
         'sent_messages' : sent_messages,
@@ -408,22 +547,22 @@ def send_message(request, recipient_id):
 
 @login_required
 @require_POST
-def user_follow(request):
+async def user_follow(request):
     user_id = request.POST.get('id')
     action = request.POST.get('action')
     if user_id and action:
+        user = await request.auser()
         try:
-            target_user = User.objects.get(id=user_id)
+            target_user = await User.objects.aget(id=user_id)
             if action == 'follow':
-                contact, create = Contact.objects.get_or_create(user_from=request.user, user_to=target_user)
+                contact, create = await Contact.objects.aget_or_create(user_from=user, user_to=target_user)
                 if create:
-                    Message.objects.create(sender=request.user, 
-                        recipient=target_user, 
-                        subject="🌟 你增加了一个新粉丝",
-                        body=f"用户 {request.user.profile.nickname or request.user.username} 刚刚关注了你！")
+                    await sync_to_async(enqueue)('notify_new_follower', contact_id=contact.pk)
+                    await sync_to_async(follow_author)(user.pk, target_user.pk)
 
             else:
-                Contact.objects.filter(user_from=request.user, user_to=target_user).delete()
+                await Contact.objects.filter(user_from=user, user_to=target_user).adelete()
+                await sync_to_async(unfollow_author)(user.pk, target_user.pk)
             return JsonResponse({'status': 'ok'})
         except User.DoesNotExist:
             return JsonResponse({'status': 'error'})
@@ -431,6 +570,10 @@ def user_follow(request):
 
 @login_required
 def following_posts(request):
-    following_ids = Contact.objects.filter(user_from=request.user).values_list('user_to', flat=True)
-    posts = Post.objects.filter(author_id__in=following_ids, published_date__isnull=False).order_by('-published_date')
-    return render(request, 'user/following_posts.html', {'posts' : posts})
\ No newline at end of file
+    cursor = request.GET.get('cursor')
+    posts, next_cursor = timeline_page(request.user, cursor)
+    rebuilding = False
+    if not posts and not cursor and Contact.objects.filter(user_from=request.user).exists():
+        request_rebuild(request.user.pk)
+        rebuilding = True
+    return render(request, 'user/following_posts.html', {'posts' : posts, 'next_cursor': next_cursor, 'rebuilding': rebuilding})
\ No newline at end of file
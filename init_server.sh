@@ -8,6 +8,7 @@ fi
 echo "Synchronizing database structure..."
 python manage.py makemigrations
 python manage.py migrate
+python manage.py createcachetable
 
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
@@ -17,4 +18,5 @@ python manage.py setup_groups
 
 echo "------------------------------------------------"
 echo "✅ Initialization complete! You can run the service now."
+echo "Upgrading a site with existing posts? Run ./backfill_data.sh once."
 echo "------------------------------------------------"
\ No newline at end of file
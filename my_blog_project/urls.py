@@ -14,12 +14,13 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.contrib.auth import views as auth_views
 from blog import views
 from django.conf import settings
-from django.conf.urls.static import static
+from blog.media import serve_media
 from django_ratelimit.decorators import ratelimit
 
 urlpatterns = [
@@ -34,4 +35,5 @@ urlpatterns = [
     path('users/', views.user_list, name='user_list'),
     path('users/<str:username>/', views.profile_public, name='profile_public'),
     path('user/follow/', views.user_follow, name='user_follow'),
-]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
+]